@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+import pickle
+
+from spiki import __version__
+
+
+class Cache:
+    """
+    A directory of pickled objects, each keyed by a hash of the data it was made from.
+
+    Entries are touched whenever they are read, so that eviction may discard
+    those least recently used once the directory grows beyond its size limit.
+
+    """
+
+    @staticmethod
+    def default_path() -> Path:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+        return Path(base).joinpath("spiki")
+
+    def __init__(self, path: Path, namespace: str = "", max_size: int = 256 * 2 ** 20):
+        self.path = Path(path).joinpath(namespace) if namespace else Path(path)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.logger = logging.getLogger("cache")
+
+    def key(self, data: bytes) -> str:
+        # Entries made by other versions of spiki are never used
+        rv = hashlib.blake2b(__version__.encode("ascii"), digest_size=20)
+        rv.update(b"\0")
+        rv.update(data)
+        return rv.hexdigest()
+
+    def get(self, key: str):
+        path = self.path.joinpath(f"{key}.pickle")
+        try:
+            rv = pickle.loads(path.read_bytes())
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as error:
+            self.logger.warning(f"Discarding cache entry {path.name}: {error}")
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return rv
+
+    def put(self, key: str, obj: object):
+        path = self.path.joinpath(f"{key}.pickle")
+        temp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            temp.write_bytes(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+            os.replace(temp, path)
+        except (OSError, pickle.PicklingError) as error:
+            self.logger.warning(f"Unable to cache {path.name}: {error}")
+        finally:
+            temp.unlink(missing_ok=True)
+        return obj
+
+    def evict(self) -> int:
+        "Remove the entries least recently used until the total size is within the limit."
+        entries = []
+        for path in self.path.glob("*.pickle"):
+            try:
+                entries.append((path.stat(), path))
+            except OSError:
+                continue
+
+        size = sum(stat.st_size for stat, _ in entries)
+        n = 0
+        for stat, path in sorted(entries, key=lambda x: x[0].st_mtime_ns):
+            if size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            size -= stat.st_size
+            n += 1
+        return n
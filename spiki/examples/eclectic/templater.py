@@ -71,6 +71,7 @@ class Templater(Plugin):
             try:
                 template = blocks.pop(0)
                 data_path = self.visitor.location_of(node).parent.joinpath(define["file"]).resolve()
+                self.visitor.depend(path, data_path)
                 for index, row in enumerate(self.sources.get(data_path, [])):
                     punc = random.choice("?!.")
                     text = template.format(define=dict(define, index=index, punc=punc, **row))
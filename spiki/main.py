@@ -23,7 +23,9 @@ from pathlib import Path
 import shutil
 import sys
 
+from spiki.cache import Cache
 from spiki.visitor import Visitor
+from spiki.watcher import Watcher
 
 from spiki.plugin import Phase
 
@@ -57,14 +59,19 @@ def main(args):
     plugin_types = args.plugin or default_plugin_types
     args.output = args.output.expanduser()
     args.paths = [i.expanduser() for i in args.paths]
+    args.cache = args.cache and args.cache.expanduser()
     logger.debug(f"{args=}")
 
     args.output.mkdir(parents=True, exist_ok=True)
-    with Visitor(*plugin_types, **vars(args)) as visitor:
+    # No change is kept here, so each page may be rendered straight to its file
+    with Visitor(*plugin_types, stream=True, **vars(args)) as visitor:
         for n, change in enumerate(visitor.walk(*args.paths)):
             pass
 
-    logger.info(f"Completed {n} actions", extra=dict(phase=Phase.REPORT))
+        logger.info(f"Completed {n} actions", extra=dict(phase=Phase.REPORT))
+        if args.watch:
+            Watcher(visitor, interval=args.interval).run(*args.paths)
+
     return 0
 
 
@@ -74,6 +81,54 @@ def parser():
     rv.add_argument("paths", nargs="+", type=Path, help="Specify file paths")
     rv.add_argument("-O", "--output", type=Path, default=default_path, help=f"Specify output directory [{default_path}]")
     rv.add_argument("--plugin", action="append", help=f"Specify plugin list {default_plugin_types}")
+    rv.add_argument(
+        "--include", action="append", metavar="GLOB",
+        help=f"Survey only those files which match this pattern (may be repeated)"
+    )
+    rv.add_argument(
+        "--exclude", action="append", metavar="GLOB",
+        help=f"Ignore files and directories which match this pattern (may be repeated)"
+    )
+    rv.add_argument(
+        "--cache", type=Path, nargs="?", const=(cache := Cache.default_path()), default=None,
+        help=f"Keep parsed sources and SpeechMark blocks in a cache directory [{cache}]"
+    )
+    rv.add_argument(
+        "--incremental", action="store_true", default=False,
+        help=f"Skip pages whose sources are unchanged since the last build"
+    )
+    rv.add_argument(
+        "-j", "--jobs", type=int, default=(jobs := 1),
+        help=f"Run parallel phases over this number of processes [{jobs}]"
+    )
+    rv.add_argument(
+        "--watch", action="store_true", default=False,
+        help=f"Keep running, and rebuild whenever source files change"
+    )
+    rv.add_argument(
+        "--interval", type=float, default=(interval := 0.5),
+        help=f"Set the polling interval in seconds when watching for changes [{interval}]"
+    )
+    rv.add_argument(
+        "--export", choices=["stage", "direct", "swap"], default=(export := "stage"),
+        help=(
+            "Stage files in a temporary directory then copy them to the output, "
+            "write them directly to the output, or swap the output for a staged copy "
+            f"[{export}]"
+        )
+    )
+    rv.add_argument(
+        "--link", action="store_true", default=False,
+        help=f"Link assets to their sources rather than copy them, so that editing one changes the other"
+    )
+    rv.add_argument(
+        "--low-memory", action="store_true", default=False,
+        help=f"Release the data of each page once it is written, so as to reduce peak memory"
+    )
+    rv.add_argument(
+        "--report", type=Path, default=None,
+        help=f"Save timings and counts for each phase and plugin to this JSON file"
+    )
     rv.add_argument("--debug", action="store_true", default=False, help=f"Display debug logs")
     rv.convert_arg_line_to_args = lambda x: x.split()
     return rv
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from spiki import __version__
+
+
+class Manifest:
+    """
+    A record of the sources which went into a build, and the outputs they produced.
+
+    The manifest is stored as JSON next to the output directory. On the next build it tells
+    the Visitor which sources are unchanged, so that their pages need not be processed again.
+
+    """
+
+    def __init__(self, path: Path, plugins: list[str] = None):
+        self.path = path
+        self.plugins = list(plugins or [])
+        self.entries = dict()
+        self.digests = dict()
+        self.logger = logging.getLogger("manifest")
+
+    @property
+    def signature(self) -> dict:
+        return dict(version=__version__, plugins=self.plugins)
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return self
+        except (OSError, ValueError) as error:
+            self.logger.warning(f"Ignoring manifest {self.path.name}: {error}")
+            return self
+
+        if data.get("signature") == self.signature:
+            self.entries = data.get("entries", {})
+        else:
+            self.logger.info(f"Build signature has changed. Manifest {self.path.name} discarded.")
+        return self
+
+    def save(self):
+        data = dict(signature=self.signature, entries=self.entries)
+        self.path.write_text(json.dumps(data, indent=0, sort_keys=True))
+        return self
+
+    @staticmethod
+    def key(path: Path, root: Path) -> str:
+        try:
+            return path.relative_to(root).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def digest(self, path: Path, key: str = None) -> str:
+        "Return a content hash for the file at `path`, avoiding a read when its stat is unchanged."
+        try:
+            return self.digests[path]
+        except KeyError:
+            pass
+
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+
+        entry = self.entries.get(key, {})
+        if entry.get("stat") == [stat.st_mtime_ns, stat.st_size]:
+            rv = entry["hash"]
+        else:
+            rv = hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest()
+        self.digests[path] = rv
+        return rv
+
+    def digest_all(self, paths: list[Path], root: Path) -> dict[str, str]:
+        return {self.key(i, root): self.digest(i, self.key(i, root)) for i in paths}
+
+    def inputs(self, path: Path, root: Path, chain: list[Path]) -> dict:
+        key = self.key(path, root)
+        stat = path.stat()
+        depends = [root.joinpath(i) for i in self.entries.get(key, {}).get("depends", {})]
+        return dict(
+            hash=self.digest(path, key),
+            stat=[stat.st_mtime_ns, stat.st_size],
+            chain=self.digest_all(chain, root),
+            depends=self.digest_all(depends, root),
+        )
+
+    def unchanged(self, key: str, inputs: dict, output: Path) -> bool:
+        try:
+            entry = self.entries[key]
+            return (
+                entry["hash"] == inputs["hash"]
+                and entry["chain"] == inputs["chain"]
+                and entry["depends"] == inputs["depends"]
+                and output.joinpath(entry["result"]).exists()
+            )
+        except (KeyError, TypeError):
+            return False
+
+    def record(self, key: str, inputs: dict, result: str, depends: dict[str, str] = None):
+        self.entries[key] = dict(inputs, depends=depends or {}, result=result)
+
+    @property
+    def graph(self) -> dict[str, list[str]]:
+        "Map each page to the files upon which its output depends."
+        return {k: sorted(set(v.get("chain", [])).union(v.get("depends", []))) for k, v in self.entries.items()}
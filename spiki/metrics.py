@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from collections import Counter
+from collections import defaultdict
+from collections.abc import Generator
+from collections.abc import Iterable
+import dataclasses
+import heapq
+import json
+from pathlib import Path
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+from spiki import __version__
+from spiki.plugin import Change
+from spiki.plugin import Phase
+
+
+def peak_memory() -> int:
+    "Return the peak resident set size of this process in bytes, or zero if it is not known."
+    if resource is None:
+        return 0
+    rv = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rv if sys.platform == "darwin" else rv * 1024
+
+
+@dataclasses.dataclass
+class Tally:
+    calls:      int     = 0
+    changes:    int     = 0
+    wall:       float   = 0
+    cpu:        float   = 0
+    bytes_in:   int     = 0
+    bytes_out:  int     = 0
+
+    def __iadd__(self, other: "Tally"):
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+        return self
+
+
+class Metrics:
+    """
+    Accumulates timings and counts for each plugin in each phase, and for each path.
+
+    """
+
+    @staticmethod
+    def size(text: str) -> int:
+        return len(text.encode("utf8")) if isinstance(text, str) else 0
+
+    def __init__(self):
+        self.tallies = defaultdict(Tally)
+        self.paths = defaultdict(Tally)
+        self.phases = defaultdict(float)
+        self.counts = Counter()
+
+    def merge(self, other: "Metrics"):
+        for key, tally in other.tallies.items():
+            self.tallies[key] += tally
+        for path, tally in other.paths.items():
+            self.paths[path] += tally
+        return self
+
+    def measure(
+        self, phase: Phase, plugin: object, path: Path, changes: Iterable[Change], *inputs: tuple[str]
+    ) -> Generator[Change]:
+        "Pass on the changes from a plugin, timing the work done to produce each one."
+        tally = Tally(calls=1, bytes_in=sum(self.size(i) for i in inputs))
+        changes = iter(changes)
+        try:
+            while True:
+                wall = time.perf_counter()
+                cpu = time.process_time()
+                try:
+                    change = next(changes)
+                except StopIteration:
+                    return
+                finally:
+                    tally.wall += time.perf_counter() - wall
+                    tally.cpu += time.process_time() - cpu
+
+                tally.changes += 1
+                tally.bytes_out += self.size(change and change.text) + self.size(change and change.doc)
+                yield change
+        finally:
+            self.tallies[(phase.name, type(plugin).__name__)] += tally
+            if path is not None:
+                self.paths[path] += dataclasses.replace(tally, changes=0, bytes_in=0, bytes_out=0)
+
+    def clock(self, phase: Phase, changes: Iterable[Change]) -> Generator[Change]:
+        "Pass on the changes of a phase, adding to it the time spent producing them but not that spent consuming them."
+        changes = iter(changes)
+        while True:
+            start = time.perf_counter()
+            try:
+                change = next(changes)
+            except StopIteration:
+                return
+            finally:
+                self.phases[phase] += time.perf_counter() - start
+            yield change
+
+    def report(self, root: Path = None, slowest: int = 10) -> dict:
+        def key(path: Path) -> str:
+            try:
+                return path.relative_to(root).as_posix()
+            except (TypeError, ValueError):
+                return format(path)
+
+        return dict(
+            version=__version__,
+            wall=sum(self.phases.values()),
+            peak_memory=peak_memory(),
+            counts=dict(self.counts),
+            phases={k.name: v for k, v in self.phases.items()},
+            plugins=[
+                dict(phase=phase, plugin=plugin, **dataclasses.asdict(tally))
+                for (phase, plugin), tally in self.tallies.items()
+            ],
+            slowest=[
+                dict(path=key(path), **dataclasses.asdict(tally))
+                for path, tally in heapq.nlargest(slowest, self.paths.items(), key=lambda x: x[1].wall)
+            ],
+        )
+
+    def table(self, report: dict) -> Generator[str]:
+        yield f"{'Phase':<8} {'Plugin':<16} {'Calls':>7} {'Changes':>8} {'Wall s':>8} {'CPU s':>8} {'In kB':>9} {'Out kB':>9}"
+        for row in report["plugins"]:
+            yield (
+                f"{row['phase']:<8} {row['plugin']:<16} {row['calls']:>7} {row['changes']:>8} "
+                f"{row['wall']:>8.3f} {row['cpu']:>8.3f} "
+                f"{row['bytes_in'] / 1024:>9.1f} {row['bytes_out'] / 1024:>9.1f}"
+            )
+        yield f"{'Total':<33} {'':>8} {report['wall']:>8.3f}"
+        for row in report["slowest"]:
+            yield f"{row['wall']:>8.3f} s {row['path']}"
+
+    def write(self, path: Path, root: Path = None, slowest: int = 10) -> dict:
+        rv = self.report(root=root, slowest=slowest)
+        path.write_text(json.dumps(rv, indent=2))
+        return rv
@@ -53,6 +53,11 @@ class Change:
 
 class Plugin:
 
+    # Phases in which this plugin may safely process paths in parallel.
+    # In each of them, the plugin must read and modify the state of its own path only.
+    # It returns a new node to change that of its path, rather than modifying the one it was given.
+    parallel = frozenset()
+
     def __init__(self, visitor: "Pathfinder" = None):
         self.logger = logging.getLogger(self.__class__.__name__.lower())
         self.visitor = visitor
@@ -77,12 +82,16 @@ class Plugin:
             return
 
         rv = method(path=path, node=node, doc=doc, **kwargs)
+        debug = self.logger.isEnabledFor(logging.DEBUG)
         if isinstance(rv, Generator):
-            rv = list(rv)
-            self.logger.debug(f"Generator: {method} {[type(i) for i in rv]=}", extra=dict(phase=phase))
+            if debug:
+                # Generators are otherwise consumed lazily, one change at a time
+                rv = list(rv)
+                self.logger.debug(f"Generator: {method} {[type(i) for i in rv]=}", extra=dict(phase=phase))
             yield from rv
         else:
-            self.logger.debug(f"Function: {method} {type(rv)=}", extra=dict(phase=phase))
+            if debug:
+                self.logger.debug(f"Function: {method} {type(rv)=}", extra=dict(phase=phase))
             yield rv or Change(self, phase=phase, path=path, node=node, doc=doc)
 
     @staticmethod
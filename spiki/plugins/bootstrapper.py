@@ -38,6 +38,10 @@ except (ImportError, ModuleNotFoundError):
 
 class Bootstrapper(Plugin):
 
+    def __init__(self, visitor=None):
+        super().__init__(visitor)
+        self.deferred = False
+
     @staticmethod
     def get_filepath(module_name: str) -> pathlib.Path:
         module = sys.modules[module_name]
@@ -60,18 +64,37 @@ class Bootstrapper(Plugin):
         )
         return Change(self, path=path, text=text, node=node, phase=self.phase)
 
-    def end_export(self, **kwargs) -> Change:
+    def archive(self, source: pathlib.Path):
+        "Zip the files of this build, and nothing else which may lie in the same directory."
         path = self.visitor.root.joinpath("__main__.py")
-        change = self.visitor.state[path]
-        source = change.result.parent
-
         output = self.visitor.options["output"]
         target = output.with_suffix(".pyz")
+        names = {
+            i.result.relative_to(parent)
+            for i in self.visitor.state.values() if i.result
+            for parent in {source, self.visitor.space} if i.result.is_relative_to(parent)
+        }
         self.logger.info(
             f"Creating {target}",
             extra=dict(path=path.relative_to(self.visitor.root), phase=self.phase)
         )
-        zipapp.create_archive(source, target=target)
+        zipapp.create_archive(source, target=target, filter=names.__contains__)
+
+    def end_export(self, **kwargs) -> Change:
+        path = self.visitor.root.joinpath("__main__.py")
+        change = self.visitor.state[path]
+
+        # Pages left untouched by an incremental build, or unchanged in the output, are not written where
+        # the others are. They are archived from the finished output instead.
+        self.deferred = self.visitor.options.get("incremental") or not all(
+            i.result.exists() for i in self.visitor.state.values() if i.result
+        )
+        if not self.deferred:
+            self.archive(change.result.parent)
+
+    def end_report(self, **kwargs) -> Change:
+        if self.deferred:
+            self.archive(self.visitor.options["output"])
 
 
 def main(args):
@@ -15,9 +15,13 @@
 # You should have received a copy of the GNU General Public License along with spiki.
 # If not, see <https://www.gnu.org/licenses/>.
 
+from collections import Counter
 from collections.abc import Generator
+import fnmatch
+import functools
 import logging
 import mimetypes
+import os
 from pathlib import Path
 
 from spiki.plugin import Change
@@ -26,12 +30,28 @@ from spiki.plugin import Plugin
 
 class Finder(Plugin):
 
+    # Only files of these types are read into memory. Others pass through to export untouched.
+    textual = frozenset(["application/toml"])
+
+    # Files of these types are never processed.
+    blocked = frozenset(["", "application/x-python-code", "text/x-python"])
+
+    # Glob patterns for files and directories which are not surveyed.
+    # Those ending in a slash match directories only, and those containing a slash match a relative path.
+    ignore = (
+        ".git/", ".hg/", ".svn/", ".tox/", ".nox/", ".venv/", "__pycache__/", "node_modules/",
+        ".spikiignore",
+    )
+    ignore_name = ".spikiignore"
+
     def __init__(self, visitor):
         super().__init__(visitor)
         self.logger = logging.getLogger("finder")
+        self.products = frozenset()
 
     def __enter__(self):
         mimetypes.add_type("application/toml", ".toml", strict=False)
+        self.type_of.cache_clear()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -39,33 +59,170 @@ class Finder(Plugin):
         return rv
 
     @staticmethod
-    def get_type(path: Path):
+    @functools.lru_cache(maxsize=1024)
+    def type_of(suffix: str) -> str:
         try:
-            t = mimetypes.guess_file_type(path, strict=False)  # Python 3.13
+            t = mimetypes.guess_file_type(f"_{suffix}", strict=False)  # Python 3.13
         except AttributeError:
-            t = mimetypes.guess_type(path, strict=False)
+            t = mimetypes.guess_type(f"_{suffix}", strict=False)
         try:
             return t[0] or ""
         except IndexError:
             return ""
 
+    @staticmethod
+    def get_type(path: Path):
+        # The type is decided by at most the last two suffixes, eg: '.tar.gz'
+        base, ext = os.path.splitext(path)
+        return Finder.type_of(os.path.splitext(base)[1] + ext)
+
+    @staticmethod
+    def read_patterns(path: Path) -> list[str]:
+        try:
+            lines = path.read_text().splitlines()
+        except (OSError, UnicodeDecodeError):
+            return []
+        return [i.strip() for i in lines if i.strip() and not i.lstrip().startswith("#")]
+
+    @staticmethod
+    def match(rel: str, is_dir: bool, rules: list[tuple[str, list[str]]]) -> bool:
+        "Test a relative path against patterns, each set of which applies below its own base directory."
+        name = rel.rpartition("/")[2]
+        for base, patterns in rules:
+            if base:
+                if not rel.startswith(base + "/"):
+                    continue
+                local = rel[len(base) + 1:]
+            else:
+                local = rel
+
+            for pattern in patterns:
+                if pattern.endswith("/"):
+                    if not is_dir:
+                        continue
+                    pattern = pattern.rstrip("/")
+
+                if "/" in pattern:
+                    if fnmatch.fnmatchcase(local, pattern.lstrip("/")):
+                        return True
+                elif fnmatch.fnmatchcase(name, pattern):
+                    return True
+        return False
+
+    @property
+    def rules(self) -> list[tuple[str, list[str]]]:
+        return [("", list(self.ignore) + list(self.visitor.options.get("exclude") or []))]
+
+    def included(self, rel: str) -> bool:
+        patterns = self.visitor.options.get("include")
+        return not patterns or self.match(rel, False, [("", patterns)])
+
+    def pruned(self, path: Path, rel: str, rules: list) -> bool:
+        # Virtual environments are recognised by their configuration file
+        return (
+            self.match(rel, True, rules) or os.fspath(path) in self.products
+            or os.path.exists(os.path.join(path, "pyvenv.cfg"))
+        )
+
+    def ignored(self, path: Path) -> bool:
+        "Apply the same rules as a survey of the whole tree to a single file."
+        root = self.visitor.root
+        try:
+            parts = path.relative_to(root).parts
+        except ValueError:
+            return False
+
+        self.products = self.visitor.products
+        if os.fspath(path) in self.products:
+            return True
+
+        rules = self.rules + [("", self.read_patterns(root.joinpath(self.ignore_name)))]
+        for n in range(1, len(parts)):
+            rel = "/".join(parts[:n])
+            if self.pruned(root.joinpath(rel), rel, rules):
+                return True
+            rules.append((rel, self.read_patterns(root.joinpath(rel, self.ignore_name))))
+
+        rel = "/".join(parts)
+        return self.match(rel, False, rules) or not self.included(rel)
+
+    def walk(self, root: Path, counts: Counter = None, quiet: bool = False) -> Generator[tuple[os.DirEntry, str]]:
+        """
+        Generate each file below a directory which is neither pruned nor ignored, with its path relative to it.
+        Directories visited and pruned are tallied in `counts` when it is given, and logged unless `quiet`.
+
+        """
+        counts = Counter() if counts is None else counts
+        self.products = self.visitor.products
+        stack = [(format(root), "", self.rules + [("", self.read_patterns(root.joinpath(self.ignore_name)))])]
+        while stack:
+            parent, rel, rules = stack.pop()
+            if not quiet:
+                self.logger.debug(f"Visiting {parent}...", extra=dict(phase=self.phase))
+            try:
+                with os.scandir(parent) as entries:
+                    entries = sorted(entries, key=lambda x: x.name)
+            except OSError as error:
+                self.logger.warning(error, extra=dict(phase=self.phase))
+                continue
+
+            counts["dirs"] += 1
+            dirs = []
+            for entry in entries:
+                entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    is_file = not is_dir and entry.is_file()
+                except OSError:
+                    continue
+
+                if is_dir:
+                    if self.pruned(entry.path, entry_rel, rules):
+                        if not quiet:
+                            self.logger.debug(f"Pruned directory: {entry_rel}", extra=dict(phase=self.phase))
+                        counts["pruned"] += 1
+                    else:
+                        dirs.append((entry.path, entry_rel))
+                elif (
+                    is_file and entry.path not in self.products
+                    and not self.match(entry_rel, False, rules) and self.included(entry_rel)
+                ):
+                    yield entry, entry_rel
+
+            for entry_path, entry_rel in reversed(dirs):
+                local = self.read_patterns(Path(entry_path).joinpath(self.ignore_name))
+                stack.append((entry_path, entry_rel, rules + [(entry_rel, local)] if local else rules))
+
     def gen_survey(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Generator[Change]:
-        for parent, dirnames, filenames in path.resolve().walk():
-            self.logger.info(f"Visiting {parent}...", extra=dict(phase=self.phase))
-            for name in sorted(filenames):
-                file_type = self.get_type(name)
-                p = parent.joinpath(name)
-                self.logger.info(
-                    f"Found {file_type:26} file: {name}",
-                    extra=dict(path=p.relative_to(parent), phase=self.phase)
-                )
-                yield Change(self, path=p, type=file_type)
+        if path.is_file():
+            if self.ignored(path):
+                self.logger.debug(f"Ignored file: {path.name}", extra=dict(phase=self.phase))
+                return
+            file_type = self.get_type(path.name)
+            self.logger.info(f"Found {file_type:26} file: {path.name}", extra=dict(phase=self.phase))
+            yield Change(self, path=path, type=file_type)
+            return
+
+        root = path.resolve()
+        counts = Counter()
+        for entry, rel in self.walk(root, counts):
+            file_type = self.get_type(entry.name)
+            if file_type in self.blocked:
+                self.logger.debug(f"Block {file_type:26} file: {entry.name}", extra=dict(phase=self.phase))
+                continue
+
+            counts["files"] += 1
+            self.logger.debug(f"Found {file_type:26} file: {entry.name}", extra=dict(path=rel, phase=self.phase))
+            yield Change(self, path=Path(entry.path), type=file_type)
+
+        self.logger.info(
+            f"Found {counts['files']} files in {counts['dirs']} directories ({counts['pruned']} pruned)",
+            extra=dict(path=root.name, phase=self.phase)
+        )
 
     def run_filter(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Generator[Change]:
         change = self.visitor.state[path]
-        if change.type in (
-            "", "application/x-python-code", "text/x-python",
-        ):
+        if change.type in self.blocked:
             self.logger.info(
                 f"Block {change.type:26} file: {change.path.name}",
                 extra=dict(path=change.path.name, phase=self.phase)
@@ -74,7 +231,7 @@ class Finder(Plugin):
 
     def run_ingest(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
         file_type = self.get_type(path.name)
-        if "image" in file_type:
+        if file_type not in self.textual:
             return Change(self, path=path, type=file_type)
         try:
             text = path.read_text()
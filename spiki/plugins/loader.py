@@ -21,12 +21,16 @@ import logging
 from pathlib import Path
 import tomllib
 
+from spiki.cache import Cache
 from spiki.plugin import Change
+from spiki.plugin import Phase
 from spiki.plugin import Plugin
 
 
 class Loader(Plugin):
 
+    parallel = frozenset([Phase.INGEST, Phase.ENRICH])
+
     @staticmethod
     def slices(parts: tuple):
         return [tuple()] if not parts else [parts[:n] for n in range(len(parts) + 1)]
@@ -63,15 +67,33 @@ class Loader(Plugin):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         rv = super().__exit__(exc_type, exc_val, exc_tb)
+        if self.cache is not None:
+            n = self.cache.evict()
+            self.logger.debug(f"Evicted {n} entries from {self.cache.path}", extra=dict(phase=Phase.REPORT))
         return rv
 
+    @functools.cached_property
+    def cache(self) -> Cache:
+        path = self.visitor.options.get("cache")
+        return Cache(path, namespace="toml") if path else None
+
+    def parse(self, text: str) -> dict:
+        if self.cache is None:
+            return tomllib.loads(text)
+
+        key = self.cache.key(text.encode("utf8"))
+        node = self.cache.get(key)
+        if node is None:
+            node = self.cache.put(key, tomllib.loads(text))
+        return node
+
     def run_ingest(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
         if path.suffix != ".toml":
             return
 
         try:
             text = self.visitor.state[path].text
-            node = tomllib.loads(text)
+            node = self.parse(text)
         except (AttributeError, TypeError, tomllib.TOMLDecodeError) as error:
             self.logger.warning(
                 f"Unable to read data from {path.relative_to(self.visitor.root)}",
@@ -82,22 +104,28 @@ class Loader(Plugin):
             return Change(self, path=path, node=node)
 
     def run_enrich(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
-        node.setdefault("registry", {})["path"] = path
-        node["registry"]["root"] = self.visitor.root
-        node["registry"]["node"] = path.parent.relative_to(self.visitor.root).parts
-        node["registry"]["time"] = datetime.datetime.now(tz=datetime.timezone.utc)
+        registry = dict(
+            node.get("registry", {}),
+            path=path,
+            root=self.visitor.root,
+            node=path.parent.relative_to(self.visitor.root).parts,
+            time=datetime.datetime.now(tz=datetime.timezone.utc),
+        )
 
-        node.setdefault("metadata", {})["slug"] = (
-            node.get("metadata", {}).get("slug") or
+        metadata = dict(node.get("metadata", {}))
+        metadata["slug"] = (
+            metadata.get("slug") or
             self.slugify("_".join(path.relative_to(self.visitor.root).with_suffix("").parts))
         )
-        node["metadata"]["title"] = node["metadata"].get("title", path.name)
-        return Change(self, path=path, node=node)
+        metadata["title"] = metadata.get("title", path.name)
+        return Change(self, path=path, node=dict(node, registry=registry, metadata=metadata))
 
     def run_extend(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
+        if path.suffix == ".toml":
+            self.visitor.depend(path, *(i for i in self.visitor.ancestors(path) if i != path))
+
         try:
-            index_path = path.parent.joinpath("index.toml")
-            index = self.visitor.state[index_path].node
+            index = self.visitor.state[self.visitor.indexes.get(path)].node
             node = self.merge(index, node)
         except KeyError:
             pass
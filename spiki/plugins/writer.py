@@ -15,61 +15,336 @@
 # You should have received a copy of the GNU General Public License along with spiki.
 # If not, see <https://www.gnu.org/licenses/>.
 
+from collections import Counter
+from collections.abc import Generator
+import filecmp
+import functools
 import logging
+import os
 from pathlib import Path
 import shutil
 import tempfile
 
+from spiki.cache import Cache
 from spiki.plugin import Change
+from spiki.plugin import Phase
 from spiki.plugin import Plugin
+from spiki.renderer import Blocks
+from spiki.renderer import Programs
 from spiki.renderer import Renderer
+from spiki.speechmark import SpeechMark
 
 
 class Writer(Plugin):
 
-    def run_render(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
-        doc = Renderer(node).serialize()
-        return Change(self, path=path, node=node, doc=doc)
+    parallel = frozenset([Phase.RENDER])
 
-    def run_export(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
+    @staticmethod
+    def replace(dest: Path, data: bytes = None, source: Path = None, link: bool = False):
+        "Write a file under a temporary name, then rename it so that readers never see it partly written."
+        temp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+        try:
+            if source is None:
+                temp.write_bytes(data)
+            else:
+                Writer.clone(source, temp, link=link)
+            os.replace(temp, dest)
+        finally:
+            temp.unlink(missing_ok=True)
+
+    @staticmethod
+    def clone(source: Path, dest: Path, link: bool = False):
+        """
+        Copy a file without reading it into Python. The kernel may share its blocks copy-on-write.
+        If asked, the file is linked instead where the file system allows. Any edit to one is then an edit to both.
+
+        """
+        # Never write through an existing file, which may itself be a link to the source
+        dest.unlink(missing_ok=True)
+        if link:
+            try:
+                os.link(source, dest)
+                return
+            except OSError:
+                pass
+
+        with open(source, "rb") as src, open(dest, "wb") as dst:
+            stat = os.fstat(src.fileno())
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                    pass
+            except (AttributeError, OSError):
+                # Neither Linux nor a suitable file system. Falls back to a buffered copy.
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+                shutil.copyfileobj(src, dst)
+        os.utime(dest, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    @staticmethod
+    def identical(target: Path, data: bytes = None, source: Path = None) -> bool:
+        "Compare the existing target with new content, reading it only when the sizes match."
+        try:
+            stat = target.stat()
+            if source is None:
+                return stat.st_size == len(data) and target.read_bytes() == data
+
+            origin = source.stat()
+            if (stat.st_size, stat.st_mtime_ns) == (origin.st_size, origin.st_mtime_ns):
+                return True
+            return stat.st_size == origin.st_size and filecmp.cmp(source, target, shallow=False)
+        except (OSError, TypeError):
+            return False
+
+    def __init__(self, visitor):
+        super().__init__(visitor)
+        self.exported = []
+        self.counts = Counter()
+        self.programs = Programs()
+        self.parser = SpeechMark()
+        # Set before any worker process is forked, so that each may spool a page for this one to export
+        self.pid = os.getpid()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        rv = super().__exit__(exc_type, exc_val, exc_tb)
+        if self.cache is not None:
+            n = self.cache.evict()
+            self.logger.debug(f"Evicted {n} entries from {self.cache.path}", extra=dict(phase=Phase.REPORT))
+        return rv
+
+    @functools.cached_property
+    def cache(self) -> Cache:
+        path = self.visitor.options.get("cache")
+        return Cache(path, namespace="speechmark") if path else None
+
+    @functools.cached_property
+    def blocks(self) -> Blocks:
+        return Blocks(store=self.cache)
+
+    @property
+    def linked(self) -> bool:
+        "Assets are linked to their sources only when asked, since an edit to the output would change the source."
+        return self.visitor.options.get("link", False)
+
+    @property
+    def staged(self) -> bool:
+        return self.visitor.options.get("export", "stage") == "stage"
+
+    def target(self, dest: Path) -> Path:
+        "Return the place in the output where an exported file will finally appear."
+        if self.staged:
+            return self.visitor.options["output"].joinpath(dest.relative_to(self.visitor.space))
+        return dest
+
+    def destination(self, path: Path, node: dict) -> Path:
+        "Return the file in the export space to which a source is written."
         route = path.relative_to(self.visitor.root).parent
         parent = self.visitor.space.joinpath(route).resolve()
-        slug = node["metadata"]["slug"]
+        suffix = ".html" if path.suffix == ".toml" else path.suffix
+        return parent.joinpath(node["metadata"]["slug"]).with_suffix(suffix)
+
+    @property
+    def streamed(self) -> bool:
+        """
+        Pages are rendered straight to file when no document is kept after export.
+        That is so when the caller of the Visitor asks to stream, or to save memory, and no other plugin reads them.
+
+        """
+        options = self.visitor.options
+        return (options.get("stream", False) or options.get("low_memory", False)) and not any(
+            hasattr(i, method)
+            for i in self.visitor.running if i is not self
+            for method in ("run_render", "end_render", "run_export")
+        )
+
+    def streams(self, path: Path, doc: str = None) -> bool:
+        "True for a page which is rendered straight to its file."
+        return path.suffix == ".toml" and doc is None and self.streamed
+
+    def spooled(self, dest: Path) -> Path:
+        "Return the temporary file to which the page for a destination is rendered."
+        return dest.with_name(f".{dest.name}.{self.pid}.tmp")
+
+    def spool(self, node: dict, dest: Path) -> Path:
+        "Render a page to a temporary file beside its destination."
+        rv = self.spooled(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with open(rv, "wb") as output:
+            Renderer(node, cache=self.programs, parser=self.parser, blocks=self.blocks).stream(output)
+        return rv
+
+    def stream(self, path: Path, node: dict, dest: Path) -> Change:
+        "Render a page to a temporary file, which then replaces the destination unless it is unchanged."
+        temp = self.spooled(dest)
+        try:
+            if not (self.visitor.concurrent(Phase.RENDER) and temp.exists()):
+                self.spool(node, dest)
+            size = temp.stat().st_size
+
+            if self.identical(self.target(dest), source=temp):
+                self.logger.debug(
+                    f"Unchanged {dest.relative_to(self.visitor.space)}",
+                    extra=dict(path=path.relative_to(self.visitor.root), phase=self.phase)
+                )
+                self.counts["skipped"] += 1
+                return Change(self, path=path, node=node, result=dest)
+
+            # Renaming never writes through a staged file which is linked into the output
+            os.replace(temp, dest)
+        except Exception:
+            self.logger.warning(
+                f"Unable to write document for {path.relative_to(self.visitor.root)}",
+                extra=dict(path=path, phase=self.phase), exc_info=True
+            )
+            return
+        finally:
+            temp.unlink(missing_ok=True)
+
+        self.logger.debug(
+            f"Streamed {size} bytes to {dest.relative_to(self.visitor.space)}",
+            extra=dict(path=path.relative_to(self.visitor.root), phase=self.phase)
+        )
+        self.exported.append(dest)
+        self.counts["written"] += 1
+        return Change(self, path=path, node=node, result=dest)
 
-        if path.suffix == ".toml":
-            dest = parent.joinpath(slug).with_suffix(".html")
-            text = doc
-        else:
-            dest = parent.joinpath(slug).with_suffix(path.suffix)
-            text = self.visitor.state[path].text
+    def run_render(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
+        if self.streamed:
+            if self.streams(path, doc) and self.visitor.concurrent(Phase.RENDER):
+                # Each worker renders its pages to file, which export then moves into place
+                dest = self.destination(path, node)
+                try:
+                    self.spool(node, dest)
+                except Exception:
+                    self.spooled(dest).unlink(missing_ok=True)
+                    raise
+            # Otherwise rendering is left to export, which writes the page as it is generated
+            return Change(self, path=path, node=node, doc=doc)
+        doc = Renderer(node, cache=self.programs, parser=self.parser, blocks=self.blocks).serialize()
+        return Change(self, path=path, node=node, doc=doc)
+
+    def run_export(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
+        dest = self.destination(path, node)
+        text = doc if path.suffix == ".toml" else self.visitor.state[path].text
 
         self.logger.info(
             f"Exporting to {dest.relative_to(self.visitor.space)}",
             extra=dict(path=path.relative_to(self.visitor.root), phase=self.phase)
         )
+        if self.streams(path, doc):
+            return self.stream(path, node, dest)
+        # No spool is left in the output by a page which is not streamed after all
+        self.spooled(dest).unlink(missing_ok=True)
+
+        data = text.encode("utf8") if isinstance(text, str) else None
+        source = None if data is not None else path
+        if self.identical(self.target(dest), data=data, source=source):
+            # Leave the file untouched so that its mtime is kept for the benefit of sync tools
+            self.logger.debug(
+                f"Unchanged {dest.relative_to(self.visitor.space)}",
+                extra=dict(path=path.relative_to(self.visitor.root), phase=self.phase)
+            )
+            self.counts["skipped"] += 1
+            return Change(self, path=path, node=node, doc=doc, result=dest)
+
         try:
-            dest.write_text(text)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if self.staged:
+                # The staged file may be linked into the output by a previous export
+                dest.unlink(missing_ok=True)
+                dest.write_bytes(data)
+            else:
+                self.replace(dest, data=data)
         except TypeError:
             try:
-                shutil.copyfile(path, dest)
+                if self.staged:
+                    self.clone(path, dest, link=self.linked)
+                else:
+                    self.replace(dest, source=path, link=self.linked)
             except Exception:
                 self.logger.warning(
                     f"Unable to copy {path.relative_to(self.visitor.root)}",
                     extra=dict(path=path.relative_to(self.visitor.root), phase=self.phase)
                 )
+                return
         except Exception:
             self.logger.warning(
                 f"Unable to write document for {path.relative_to(self.visitor.root)}",
                 extra=dict(path=path, phase=self.phase)
             )
-        else:
-            return Change(self, path=path, node=node, doc=doc, result=dest)
+            return
+
+        self.exported.append(dest)
+        self.counts["written"] += 1
+        return Change(self, path=path, node=node, doc=doc, result=dest)
+
+    def remove(self) -> Generator[Path]:
+        "Delete the outputs of sources which no longer exist, as found by the Visitor or recorded in the manifest."
+        results = {i.result for i in self.visitor.state.values() if i.result}
+        for path, result in self.visitor.removed.items():
+            if not result or result in results:
+                continue
+            if not result.is_relative_to(self.visitor.space):
+                # A result of a previous build, since swapped into the output
+                result = self.visitor.space.joinpath(result.relative_to(self.visitor.options["output"].resolve()))
+
+            targets = [i for i in {result, self.target(result)} if i.exists()]
+            for target in targets:
+                target.unlink()
+            if targets:
+                self.logger.info(
+                    f"Removed {result.relative_to(self.visitor.space)}",
+                    extra=dict(path=path.relative_to(self.visitor.root), phase=self.phase)
+                )
+                yield self.target(result)
+
+        manifest = self.visitor.manifest
+        if not manifest:
+            return
+
+        keys = {manifest.key(i, self.visitor.root) for i in self.visitor.state}
+        results = {v.get("result") for k, v in manifest.entries.items() if k in keys}
+        for key, entry in manifest.entries.items():
+            result = entry.get("result")
+            if key in keys or not result or result in results:
+                continue
+
+            target = self.target(self.visitor.space.joinpath(result))
+            try:
+                target.unlink()
+            except FileNotFoundError:
+                continue
+            self.logger.info(f"Removed {result}", extra=dict(path=key, phase=self.phase))
+            yield target
 
     def end_export(self, path: Path = None, node: dict = None, doc: str = None, **kwargs) -> Change:
         output = self.visitor.options["output"]
+        self.counts["removed"] += len(list(self.remove()))
+
+        if self.staged:
+            self.logger.debug(
+                    f"Copying {len(self.exported)} files from {self.visitor.space} to {output}...",
+                    extra=dict(path=path, phase=self.phase)
+            )
+            # Copy only what was exported since the last time, so that a refresh need not copy the whole site.
+            # Staged files are private to this build, and always unlinked before they are written again.
+            for dest in self.exported:
+                target = output.joinpath(dest.relative_to(self.visitor.space))
+                target.parent.mkdir(parents=True, exist_ok=True)
+                self.clone(dest, target, link=True)
+        self.exported.clear()
+        self.programs.clear()
         self.logger.debug(
-                f"Copying from {self.visitor.space} to {output}...",
-                extra=dict(path=path, phase=self.phase)
+            f"Parsed {self.blocks.misses} SpeechMark blocks, reused {self.blocks.hits}",
+            extra=dict(phase=self.phase)
+        )
+
+        self.logger.info(
+            f"Wrote {self.counts['written']} files, "
+            f"skipped {self.counts['skipped']} unchanged, removed {self.counts['removed']}",
+            extra=dict(phase=self.phase)
         )
-        shutil.copytree(self.visitor.space, output, dirs_exist_ok=True)
+        if self.visitor.metrics is not None:
+            self.visitor.metrics.counts.update({k: self.counts[k] for k in ("written", "skipped", "removed")})
+        self.counts.clear()
         return Change(self)
@@ -21,16 +21,132 @@ https://html.spec.whatwg.org/multipage/
 """
 
 from collections import ChainMap
+from collections import OrderedDict
+from collections.abc import Callable
 from collections.abc import Generator
-import copy
 import enum
+import codecs
+import functools
 import html
+import io
+import itertools
 import sys
 import textwrap
 from types import SimpleNamespace
 import warnings
 
+from spiki.cache import Cache
 from spiki.speechmark import SpeechMark
+from spiki.substitution import Substitution
+
+
+class Slot:
+    "A part of a render program which must be filled from the context of each page."
+
+    __slots__ = ("entry", "tree", "finish")
+
+    def __init__(self, entry: Substitution, tree: dict, finish: Callable):
+        self.entry = entry
+        self.tree = tree
+        self.finish = finish
+
+
+class Fragment:
+    "A compiled program with slots, whose output may be reused wherever the slots fill the same way."
+
+    __slots__ = ("key", "items", "slots")
+
+    def __init__(self, key: tuple, items: list[str | Slot]):
+        self.key = key
+        self.items = items
+        self.slots = [i for i in items if isinstance(i, Slot)]
+
+
+class Programs(dict):
+    """
+    Compiled render programs for subtrees of a template, keyed by object identity.
+
+    Loader merges the base of an index into each page by reference, so the same subtree
+    objects recur in the nodes of many pages. A subtree is compiled the second time it is seen.
+    Each program keeps a reference to its subtree, so that no key can be reused while it is cached.
+
+    The rendered output of each fragment is kept too, keyed by the text with which its slots are filled.
+    Those least recently used are discarded once the total length exceeds `limit` characters.
+
+    """
+
+    def __init__(self, limit: int = 1 << 24):
+        super().__init__()
+        self.seen = set()
+        self.limit = limit
+        self.fragments = OrderedDict()
+        self.length = 0
+
+    def clear(self):
+        super().clear()
+        self.seen.clear()
+        self.fragments.clear()
+        self.length = 0
+
+    def recall(self, key: tuple) -> str:
+        try:
+            self.fragments.move_to_end(key)
+            return self.fragments[key]
+        except KeyError:
+            return None
+
+    def store(self, key: tuple, text: str) -> str:
+        self.fragments[key] = text
+        self.length += len(text)
+        while self.length > self.limit and self.fragments:
+            self.length -= len(self.fragments.popitem(last=False)[1])
+        return text
+
+
+class Blocks(OrderedDict):
+    """
+    Rendered SpeechMark blocks, keyed by their text and the options of the parser.
+
+    Blocks recur across pages, from templates and the base of an index, and across builds when
+    a script is edited in part. Those least recently used are discarded beyond `limit` entries.
+    A Cache on disk may keep them between builds.
+
+    """
+
+    def __init__(self, limit: int = 1 << 14, store: Cache = None):
+        super().__init__()
+        self.limit = limit
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, parser: SpeechMark, text: str) -> tuple[str]:
+        key = (parser.noescape, text)
+        try:
+            self.move_to_end(key)
+            self.hits += 1
+            return self[key]
+        except KeyError:
+            pass
+
+        digest = rv = None
+        if self.store is not None:
+            digest = self.store.key("\0".join(key).encode("utf8"))
+            rv = self.store.get(digest)
+
+        if rv is None:
+            rv = tuple(parser.feed(text, terminate=True))
+            parser.reset()
+            self.misses += 1
+            if self.store is not None:
+                self.store.put(digest, rv)
+        else:
+            self.hits += 1
+
+        self[key] = rv
+        while len(self) > self.limit:
+            self.popitem(last=False)
+        return rv
 
 
 class Renderer:
@@ -41,10 +157,20 @@ class Renderer:
         block_site  = ["above", "below", "stripe"]
         text_escape = ["html", "none"]
 
-    def __init__(self, template: dict = None, *, config: dict = None):
+    option_names = tuple(Options.__members__)
+
+    # Keys which configure a node rather than generate content
+    reserved = frozenset(["attrib", "blocks", "config"])
+
+    def __init__(
+        self, template: dict = None, *,
+        config: dict = None, cache: Programs = None, parser: SpeechMark = None, blocks: Blocks = None
+    ):
         self.template = template or dict()
         self.state = SimpleNamespace(attrib={}, blocks=[], config=ChainMap(config or dict()))
-        self.sm = SpeechMark()
+        self.sm = parser or SpeechMark()
+        self.cache = cache
+        self.blocks = blocks
 
     @staticmethod
     def check_config(config: dict, options: enum.Enum):
@@ -56,62 +182,158 @@ class Renderer:
                 continue
         return config
 
+    @staticmethod
+    def compile(items: list[str | Slot | Fragment]) -> list[str | Slot]:
+        "Join adjacent static lines into single chunks, leaving slots to be filled for each page."
+        rv = []
+        lines = []
+        for item in items:
+            for part in item.items if isinstance(item, Fragment) else [item]:
+                if isinstance(part, str):
+                    if part:
+                        lines.append(part)
+                elif part is not None:
+                    if lines:
+                        rv.append("\n".join(lines))
+                        lines = []
+                    rv.append(part)
+        if lines:
+            rv.append("\n".join(lines))
+        return rv
+
     def get_option(self, option: "Option", default=None):
         rv = self.state.config.get(option.name, default)
         return rv in option.value and rv
 
-    def gen_blocks(self, tree: dict, **kwargs) -> Generator[str]:
+    def mark(self, block: str, n: int) -> list[str]:
+        text = textwrap.dedent(block).strip()
+        if self.blocks is None:
+            lines = list(self.sm.feed(text, terminate=True))
+            self.sm.reset()
+        else:
+            lines = self.blocks.parse(self.sm, text)
+        return [line.replace('<li id="', f'<li id="{n:02d}-') for line in lines]
+
+    def substitution(self, text: str, tree: dict) -> Substitution:
+        try:
+            return Substitution.compile(text)
+        except Exception as error:
+            raise type(error)(f"Error: {error}\n{text=}\n{tree=}") from error
+
+    def fill(self, slot: Slot, context: dict) -> str:
+        try:
+            return slot.entry.format(slot.tree, context, reserved=self.reserved)
+        except Exception as error:
+            raise type(error)(f"Error: {error}\nentry={slot.entry.text!r}\ntree={slot.tree!r}") from error
+
+    def fill_node(self, tag: str, attrs: str, tag_mode: str, escape: bool, text: str) -> list[str]:
+        return [self.element(tag, attrs, tag_mode, html.escape(text) if escape else text)]
+
+    @staticmethod
+    def element(tag: str, attrs: str, tag_mode: str, entry: str) -> str:
+        if tag_mode == "open":
+            return f"<{tag}{attrs}>"
+        elif tag_mode == "pair":
+            return f"<{tag}{attrs}>{entry}</{tag}>"
+        elif tag_mode == "void":
+            return f"<{tag}{attrs} />"
+
+    def emit_blocks(self, tree: dict) -> Generator[str | Slot | Fragment]:
         block_wrap = self.get_option(self.Options.block_wrap)
         for n, block in enumerate(self.state.blocks):
             if block_wrap:
                 yield f'<{block_wrap} id="{n:02d}">'
-            try:
-                block = block.format(**dict(kwargs, **tree))
-            except Exception as error:
-                raise type(error)(f"Error: {error}\n{block=}\n{tree=}") from error
-            for line in self.sm.feed(textwrap.dedent(block).strip(), terminate=True):
-                yield line.replace('<li id="', f'<li id="{n:02d}-')
-            self.sm.reset()
+            block = self.substitution(block, tree)
+            if block.static:
+                yield from self.mark(block.format(), n)
+            else:
+                yield Slot(block, tree, functools.partial(self.mark, n=n))
             if block_wrap:
                 yield f"</{block_wrap}>"
 
-    def gen_nodes(self, tree: dict, **kwargs) -> Generator[str]:
+    def emit_nodes(self, tree: dict) -> Generator[str | Slot | Fragment]:
         attrs =  (" " + " ".join(f'{k}="{html.escape(v)}"' for k, v in self.state.attrib.items())).rstrip()
         tag_mode = self.get_option(self.Options.tag_mode)
-        pool = [(tag, v) for tag, v in tree.items() if isinstance(v, str)]
+        escape = self.get_option(self.Options.text_escape, "html") == "html"
+        pool = [(tag, v) for tag, v in tree.items() if isinstance(v, str) and tag not in self.reserved]
         for tag, entry in pool:
-            if self.get_option(self.Options.text_escape, "html") == "html":
-                entry = html.escape(entry.format(**dict(kwargs, **tree)))
+            entry = self.substitution(entry, tree)
+            if entry.static:
+                text = entry.format()
+                yield self.element(tag, attrs, tag_mode, html.escape(text) if escape else text)
             else:
-                entry = entry.format(**dict(kwargs, **tree))
+                yield Slot(entry, tree, functools.partial(self.fill_node, tag, attrs, tag_mode, escape))
 
-            if tag_mode == "open":
-                yield f"<{tag}{attrs}>"
-            elif tag_mode == "pair":
-                yield f"<{tag}{attrs}>{entry}</{tag}>"
-            elif tag_mode == "void":
-                yield f"<{tag}{attrs} />"
+    def resolve(self, items: list[str | Slot | Fragment], context: dict) -> Generator[str]:
+        for item in items:
+            if isinstance(item, str):
+                yield item
+            elif isinstance(item, Fragment):
+                yield self.reuse(item, context)
+            elif item is not None:
+                yield from item.finish(self.fill(item, context))
 
-    def walk(self, tree: dict, path: list = None, context: dict = None) -> Generator[str]:
-        path = path or list()
-        context = context or dict()
+    def reuse(self, fragment: Fragment, context: dict) -> str:
+        "Render a fragment, or recall its output when its slots have been filled the same way before."
+        texts = tuple(self.fill(i, context) for i in fragment.slots)
+        key = (fragment.key, texts)
+        rv = self.cache.recall(key)
+        if rv is None:
+            texts = iter(texts)
+            lines = (
+                [item] if isinstance(item, str) else item.finish(next(texts))
+                for item in fragment.items
+            )
+            rv = self.cache.store(key, "\n".join(filter(None, itertools.chain.from_iterable(lines))))
+        return rv
 
+    def gen_blocks(self, tree: dict, **kwargs) -> Generator[str]:
+        yield from self.resolve(self.emit_blocks(tree), kwargs)
+
+    def gen_nodes(self, tree: dict, **kwargs) -> Generator[str]:
+        yield from self.resolve(self.emit_nodes(tree), kwargs)
+
+    def descend(self, tree: dict, path: list) -> Generator[str | Slot | Fragment]:
+        "Emit the program for a subtree, from the cache if it has been compiled before."
+        if self.cache is None:
+            yield from self.emit(tree, path)
+            return
+
+        key = (
+            id(tree),
+            next((i for i in reversed(path) if isinstance(i, str)), None),
+            tuple(map(self.state.config.get, self.option_names)),
+        )
         try:
-            self.state.attrib = tree.pop("attrib", {})
-        except AttributeError:
+            yield from self.cache[key][1]
+        except KeyError:
+            if key in self.cache.seen:
+                program = self.compile(self.emit(tree, path))
+                if any(isinstance(i, Slot) for i in program):
+                    program = [Fragment(key, program)]
+                self.cache[key] = (tree, program)
+                yield from program
+            else:
+                self.cache.seen.add(key)
+                yield from self.emit(tree, path)
+
+    def emit(self, tree: dict, path: list) -> Generator[str | Slot | Fragment]:
+        "Generate the static text of a subtree, and slots for those parts which must be formatted."
+        if not isinstance(tree, dict):
             # String values
             return
 
-        blocks = tree.pop("blocks", "")
+        self.state.attrib = tree.get("attrib", {})
+        blocks = tree.get("blocks", "")
         self.state.blocks = [blocks] if blocks and isinstance(blocks, str) else blocks
-        self.state.config = self.state.config.new_child(self.check_config(tree.pop("config", {}), self.Options))
+        self.state.config = self.state.config.new_child(self.check_config(tree.get("config", {}), self.Options))
 
         attrs = (" " + " ".join(f'{k}="{html.escape(v)}"' for k, v in self.state.attrib.items())).rstrip()
         tag_mode = self.get_option(self.Options.tag_mode)
 
         try:
             tag = next(i for i in reversed(path) if isinstance(i, str))
-            if any(i for i in tree.values() if isinstance(i, str)):
+            if any(v for k, v in tree.items() if isinstance(v, str) and k not in self.reserved):
                 params = ""
             else:
                 params = attrs
@@ -125,20 +347,20 @@ class Renderer:
 
         block_site = self.get_option(self.Options.block_site)
         if block_site == "above":
-            yield from self.gen_blocks(tree, **context)
-            yield from self.gen_nodes(tree, **context)
+            yield from self.emit_blocks(tree)
+            yield from self.emit_nodes(tree)
         else:
-            yield from self.gen_nodes(tree, **context)
-            yield from self.gen_blocks(tree, **context)
+            yield from self.emit_nodes(tree)
+            yield from self.emit_blocks(tree)
 
-        pool = [(k, v) for k, v in tree.items() if isinstance(v, list)]
+        pool = [(k, v) for k, v in tree.items() if isinstance(v, list) and k not in self.reserved]
         for node, entry in pool:
             for n, item in enumerate(entry):
-                yield from self.walk(item, path=path + [node, n], context=context)
+                yield from self.descend(item, path=path + [node, n])
 
-        pool = [(k, v) for k, v in tree.items() if isinstance(v, dict)]
+        pool = [(k, v) for k, v in tree.items() if isinstance(v, dict) and k not in self.reserved]
         for node, entry in pool:
-            yield from self.walk(entry, path=path + [node], context=context)
+            yield from self.descend(entry, path=path + [node])
 
         try:
             tag = next(i for i in reversed(path) if isinstance(i, str))
@@ -149,8 +371,49 @@ class Renderer:
 
         self.state.config.maps.pop(0)
 
-    def serialize(self, template: dict = None) -> str:
+    def walk(self, tree: dict, path: list = None, context: dict = None) -> Generator[str]:
+        yield from self.resolve(self.descend(tree, path or list()), context or dict())
+
+    def chunks(self, template: dict = None) -> Generator[str]:
+        "Generate the document piece by piece, with the newlines which separate its lines."
         self.template.update(template or dict())
-        context = copy.deepcopy(self.template)
+        # The tree is only read, so a shallow copy suffices to separate it from the context
+        context = dict(self.template)
         tree = context.pop("doc", dict())
-        return "\n".join(filter(None, self.walk(tree, path=[], context=context)))
+        sep = ""
+        for text in self.walk(tree, path=[], context=context):
+            if text:
+                yield sep
+                yield text
+                sep = "\n"
+
+    def serialize(self, template: dict = None) -> str:
+        return "".join(self.chunks(template))
+
+    def stream(
+        self, output: io.IOBase, template: dict = None, *, encoding: str = "utf8", size: int = 1 << 16
+    ) -> int:
+        """
+        Write the document to a text or binary stream as it is rendered, in pieces of about `size` characters.
+        Returns the number of characters, or for a binary stream the number of bytes, written.
+
+        """
+        encode = None if isinstance(output, io.TextIOBase) else codecs.getincrementalencoder(encoding)().encode
+        rv = 0
+        buffer = []
+        length = 0
+        for text in self.chunks(template):
+            buffer.append(text)
+            length += len(text)
+            if length >= size:
+                data = "".join(buffer)
+                rv += output.write(encode(data) if encode else data)
+                buffer.clear()
+                length = 0
+
+        data = "".join(buffer)
+        if encode:
+            data = encode(data, final=True)
+        if data:
+            rv += output.write(data)
+        return rv
@@ -17,12 +17,23 @@
 
 import argparse
 from collections import deque
+from collections.abc import Generator
+from collections.abc import Iterable
+import concurrent.futures
+import enum
+import functools
+import glob
 import html
 import itertools
 import operator
+import os
+from pathlib import Path
 import re
 import sys
 import textwrap
+from typing import NamedTuple
+from typing import TextIO
+import warnings
 
 from . import __version__
 
@@ -30,21 +41,88 @@ __doc__ = """"
 
 From the command line::
 
-    echo "Hello, World!" | python -m speechmark
+    echo "Hello, World!" | python -m spiki.speechmark
 
     <blockquote>
     <p>
-    Hello World!
+    Hello, World!
     </p>
     </blockquote>
 
+Input is converted block by block as it arrives.
+To convert many files over a pool of processes, saving the HTML5 beside each one::
+
+    python -m spiki.speechmark --jobs 8 "scripts/**/*.txt"
+
+HTML5 files matched by a pattern are skipped, since they may be the output of another.
+
 """
 
+class Kind(enum.Enum):
+    BLOCK           = "blockquote"
+    END_BLOCK       = "/blockquote"
+    CUE             = "cite"
+    COMMENT         = "comment"
+    LIST            = "list"
+    END_LIST        = "/list"
+    ITEM            = "li"
+    END_ITEM        = "/li"
+    PARAGRAPH       = "p"
+    END_PARAGRAPH   = "/p"
+    LINE            = "line"
+
+
+class Token(NamedTuple):
+    """
+    One step in the structure of a block. The value of each kind is:
+
+    BLOCK       The Cue which begins the block, or None
+    CUE         The Cue which begins the block
+    COMMENT     The text of a comment line
+    LIST        'ul' or 'ol'
+    END_LIST    'ul' or 'ol'
+    ITEM        The ordinal of an item in an ordered list, eg: '1', else None
+    LINE        A tuple of Span and Cue objects
+
+    """
+    kind:   Kind
+    value:  object  = None
+
+
+# Tokens without a value are shared
+PARAGRAPH = Token(Kind.PARAGRAPH)
+END_PARAGRAPH = Token(Kind.END_PARAGRAPH)
+END_ITEM = Token(Kind.END_ITEM)
+END_BLOCK = Token(Kind.END_BLOCK)
+
+
+class Cue(NamedTuple):
+    attributes = ("role", "directives", "mode", "parameters", "fragments")
+
+    role:       str
+    directives: str
+    mode:       str
+    parameters: str
+    fragments:  str
+    text:       str
+
+    @classmethod
+    def of(cls, match: re.Match) -> "Cue":
+        return cls(*match.group(*cls.attributes), match.group())
+
+
+class Span(NamedTuple):
+    "Text within a line. Its tag is 'em', 'strong', 'code', or 'a' for a link, else empty."
+    tag:    str
+    text:   str
+    href:   str = None
+
+
 class SpeechMark:
     """
     Parsing text programmatically::
 
-        from speechmark import SpeechMark
+        from spiki.speechmark import SpeechMark
 
         text = '''
         <PHONE.announcing@GUEST,STAFF> Ring riiing!
@@ -69,209 +147,352 @@ class SpeechMark:
         </p>
         </blockquote>
 
+    No history of the source is kept unless asked for. Set `maxlen` to the number of lines
+    the `text` property should recall, or to None to recall them all.
+
     """
-    def __init__(
-        self,
-        lines=[],
-        maxlen=None,
-        noescape="!\"',-;{}~",
-    ):
-        self.cue_matcher = re.compile(
-            r"""
-        ^<                          # Opening bracket
-        (?P<role>[^.:?# >]*)        # Role
-        (?P<directives>[^:?# >]*)   # Directives
-        (?P<mode>[^?# >]*)          # Mode
-        (?P<parameters>[^# >]*)     # Parameters
-        (?P<fragments>[^ >]*)       # Fragments
-        >                           # Closing bracket
-        """,
-            re.VERBOSE,
-        )
+    # Patterns and tables are built once, when the module is imported
+
+    cue_matcher = re.compile(
+        r"""
+    ^<                          # Opening bracket
+    (?P<role>[^.:?# >]*)        # Role
+    (?P<directives>[^:?# >]*)   # Directives
+    (?P<mode>[^?# >]*)          # Mode
+    (?P<parameters>[^# >]*)     # Parameters
+    (?P<fragments>[^ >]*)       # Fragments
+    >                           # Closing bracket
+    """,
+        re.VERBOSE,
+    )
 
-        self.list_matcher = re.compile(
-            r"""
-        ^\s*                        # Leading space
-        (?P<ordinal>\+|\d+\.)       # Digits and a dot
-        """,
-            re.VERBOSE,
-        )
+    list_matcher = re.compile(
+        r"""
+    ^\s*                        # Leading space
+    (?P<ordinal>\+|\d+\.)       # Digits and a dot
+    """,
+        re.VERBOSE,
+    )
 
-        self.tag_matcher = re.compile(
-            r"""
-        (?P<tag>[`*_])(?P<text>.*?)(?P=tag) # Non-greedy pair
-        """,
-            re.VERBOSE,
-        )
-        self.tagging = {"`": "code", "_": "strong", "*": "em"}
-
-        self.link_matcher = re.compile(
-            r"""
-        \[(?P<label>[^\]]*?)\]      # Non-greedy, permissive
-        \((?P<link>[^\)]*?)\)       # Non-greedy, permissive
-        """,
-            re.VERBOSE,
-        )
+    tag_matcher = re.compile(
+        r"""
+    (?P<tag>[`*_])(?P<text>.*?)(?P=tag) # Non-greedy pair
+    """,
+        re.VERBOSE,
+    )
+    tagging = {"`": "code", "_": "strong", "*": "em"}
+
+    link_matcher = re.compile(
+        r"""
+    \[(?P<label>[^\]]*?)\]      # Non-greedy, permissive
+    \((?P<link>[^\)]*?)\)       # Non-greedy, permissive
+    """,
+        re.VERBOSE,
+    )
+
+    # The characters which may begin a tag or a link
+    inline_matcher = re.compile(r"[`*_\[]")
 
-        self.escape_table = str.maketrans(
+    @staticmethod
+    @functools.cache
+    def build_escape_table(noescape: str) -> dict[int, str]:
+        "Map characters to HTML entities. One table is built for each distinct set of exceptions."
+        return str.maketrans(
             {
                 v: f"&{k}"
                 for k, v in html.entities.html5.items()
                 if k.endswith(";") and len(v) == 1 and v not in noescape + "#+.`_*[]()@?=:/"
             }
         )
-        self.source = deque(lines, maxlen=maxlen)
-        self._index = 0
+
+    def __init__(
+        self,
+        lines=[],
+        maxlen=0,
+        noescape="!\"',-;{}~",
+    ):
+        self.noescape = noescape
+        self.escape_table = self.build_escape_table(noescape)
+        self.source = deque(maxlen=maxlen)
+        self.pending = []
+        self.cue = None
+        # Blocks completed by the initial lines are emitted on the first feed
+        self.ready = deque(self.parse_lines(self.record(lines)))
 
     @property
     def text(self) -> str:
         return "\n".join(self.source)
 
-    def cue_element(self, match: re.Match) -> str:
-        details = match.groupdict()
-        if not details["role"].strip() and not details["parameters"]:
+    def record(self, lines: Iterable[str]) -> Generator[str]:
+        "Pass on each line, keeping as many of them as the history allows."
+        for line in lines:
+            self.source.append(line)
+            yield line
+
+    def cue_element(self, cue: Cue | re.Match) -> str:
+        if isinstance(cue, re.Match):
+            cue = Cue.of(cue)
+        if not cue.role.strip() and not cue.parameters:
             return ""
 
         attrs = " ".join(
-            f'data-{k}="{html.escape(v, quote=True)}"' for k, v in details.items() if v.strip()
+            f'data-{k}="{html.escape(v, quote=True)}"' for k, v in zip(Cue.attributes, cue) if v.strip()
         )
-        return f"<cite{' ' if attrs else ''}{attrs}>{details['role']}</cite>"
+        return f"<cite{' ' if attrs else ''}{attrs}>{cue.role}</cite>"
 
     def tag_element(self, match: re.Match) -> str:
-        details = match.groupdict()
-        tag = self.tagging.get(details.get("tag"), "")
-        return f"<{tag}>{details['text'].translate(self.escape_table)}</{tag}>"
+        warnings.warn("tag_element is deprecated; use span_element", DeprecationWarning, stacklevel=2)
+        return self.span_element(Span(self.tagging[match["tag"]], match["text"], None))
 
     def link_element(self, match: re.Match) -> str:
-        details = match.groupdict()
-        href = html.escape(details["link"], quote=True)
-        return f"""<a href="{href}">{details['label'].translate(self.escape_table)}</a>"""
+        warnings.warn("link_element is deprecated; use span_element", DeprecationWarning, stacklevel=2)
+        return self.span_element(Span("a", match["label"], match["link"]))
+
+    def span_element(self, span: Span | Cue) -> str:
+        if isinstance(span, Cue):
+            return self.cue_element(span)
+        elif not span.tag:
+            return span.text.translate(self.escape_table)
+        elif span.tag == "a":
+            return f"""<a href="{html.escape(span.href, quote=True)}">{span.text.translate(self.escape_table)}</a>"""
+        else:
+            return f"<{span.tag}>{span.text.translate(self.escape_table)}</{span.tag}>"
+
+    def spans(self, line: str, cue: re.Match = None) -> tuple[Span | Cue]:
+        "Divide a line into text, tags, links and cues in a single scan. A cue which begins the block is left out."
+        tokens = []
+        if line.startswith("<"):
+            match = self.cue_matcher.match(line)
+            if match:
+                tokens.append((0, match.end(), self.cue_matcher, match))
+
+        # Scan once for the start of each tag or link.
+        # Matches of the same kind never overlap, but those of different kinds may.
+        ends = {self.tag_matcher: 0, self.link_matcher: 0}
+        for marker in self.inline_matcher.finditer(line):
+            start = marker.start()
+            matcher = self.link_matcher if marker.group() == "[" else self.tag_matcher
+            if start < ends[matcher]:
+                continue
 
-    def parse_lines(self, terminate: bool):
-        # Make a local list of lines to process
-        lines = list(itertools.islice(self.source, self._index, None))
+            match = matcher.match(line, start)
+            if match:
+                ends[matcher] = match.end()
+                tokens.append((start, match.end(), matcher, match))
+
+        if not tokens:
+            return (Span("", line, None),)
+
+        if any(a[1] > b[0] for a, b in itertools.pairwise(tokens)):
+            # Overlapping matches. Only those containing no boundary of another are kept.
+            bounds = sorted({i for start, end, matcher, match in tokens for i in (start, end)} | {0, len(line)})
+            spans = {(start, end): (matcher, match) for start, end, matcher, match in tokens}
+            tokens = [
+                (start, end) + spans[(start, end)]
+                for start, end in itertools.pairwise(bounds) if (start, end) in spans
+            ]
+
+        rv = []
+        pos = 0
+        for start, end, matcher, match in tokens:
+            if start > pos:
+                rv.append(Span("", line[pos:start], None))
+            if matcher is self.tag_matcher:
+                rv.append(Span(self.tagging[match.group("tag")], match.group("text"), None))
+            elif matcher is self.link_matcher:
+                rv.append(Span("a", match.group("label"), match.group("link")))
+            elif not (cue and cue.span() == (start, end)):
+                rv.append(Cue.of(match))
+            pos = end
+        if pos < len(line):
+            rv.append(Span("", line[pos:], None))
+        return tuple(rv)
+
+    def parse_inline(self, line: str, cue: re.Match = None) -> str:
+        "Render the cues, links and tags of a line, escaping the text between them."
+        return "".join(map(self.span_element, self.spans(line, cue)))
+
+    def parse_lines(self, lines: list[str], terminate: bool = False) -> Generator[tuple[Token]]:
+        "Parse each line once, emitting each block as soon as the cue of the next one arrives."
+        for line in lines:
+            cue = self.cue_matcher.match(line)
+            if cue:
+                yield from self.flush()
+                self.cue = cue
+            self.pending.append(line)
 
-        # Match any available cues and store them by line number
-        cues = dict(
-            filter(
-                operator.itemgetter(1),
-                ((n, self.cue_matcher.match(line)) for n, line in enumerate(lines)),
-            )
-        )
+        if terminate:
+            yield from self.flush()
 
-        # Create a sequence of 2-tuples which demarcate each block
-        blocks = list(
-            itertools.pairwise(
-                sorted(set(cues.keys()).union({0, len(lines)} if terminate else {0}))
-            )
-        )
+    def flush(self) -> Generator[tuple[Token]]:
+        "Emit the block in progress. Only the lines of that block are held in memory."
+        lines, cue = self.pending, self.cue
+        self.pending = []
+        self.cue = None
 
-        end = 0
-        for begin, end in blocks:
-            cue = cues.get(begin)
-            text = "\n".join(lines[begin:end]).rstrip()
-            yield "\n".join(
-                i
-                for i in self.parse_block(cue, text.splitlines(keepends=False), terminate)
-                if isinstance(i, str)
-            )
+        text = "\n".join(lines).rstrip()
+        if text:
+            yield tuple(self.tokenize_block(cue, text.splitlines(keepends=False), terminate=True))
 
-        self._index = end
-
-    def parse_block(self, cue, lines, terminate=False):
+    def tokenize_block(self, cue: re.Match, lines: list[str], terminate=False) -> Generator[Token]:
         list_items = dict(
             filter(
                 operator.itemgetter(1),
                 ((n, self.list_matcher.match(line)) for n, line in enumerate(lines)),
             )
         )
+        first_item = min(list_items, default=sys.maxsize)
 
         list_type = ""
         paragraph = False
         for n, line in enumerate(lines):
             if n == 0:
-                if cue:
-                    yield '<blockquote cite="{0}">'.format(html.escape(cue.group(), quote=True))
-                    yield self.cue_element(cue)
-                elif not n:
-                    yield "<blockquote>"
+                head = cue and Cue.of(cue)
+                yield Token(Kind.BLOCK, head)
+                if head:
+                    yield Token(Kind.CUE, head)
 
             if line.lstrip().startswith("#"):
-                yield f"<!-- {line.translate(self.escape_table)} -->"
+                yield Token(Kind.COMMENT, line)
                 continue
 
             if n in list_items:
                 item = list_items[n]
-                yield item
-                details = item.groupdict()
+                ordinal = item.group("ordinal")
                 if list_type:
-                    yield "</p></li>"
+                    yield END_ITEM
                 else:
-                    list_type = "ul" if details["ordinal"].strip() == "+" else "ol"
+                    list_type = "ul" if ordinal.strip() == "+" else "ol"
                     if paragraph:
-                        yield "</p>"
-                    yield f"<{list_type}>"
+                        yield END_PARAGRAPH
+                    yield Token(Kind.LIST, list_type)
 
-                if list_type == "ul":
-                    yield f"<li><p>"
-                else:
-                    yield f"""<li id="{details['ordinal'].rstrip('.')}"><p>"""
+                yield Token(Kind.ITEM, None if list_type == "ul" else ordinal.rstrip("."))
                 line = line[item.end() :].lstrip()  # Retain hanging text
 
-            elif not paragraph and n < min(list_items or [sys.maxsize]):
+            elif not paragraph and n < first_item:
                 paragraph = True
-                yield f"<p>"
+                yield PARAGRAPH
             elif not line:
-                yield "</p>"
-                yield "<p>"
-
-            # Collect all matches and their substitutions
-            subs = dict(
-                (m.span(), fn(m))
-                for fn, i in (
-                    (self.cue_element, self.cue_matcher),
-                    (self.link_element, self.link_matcher),
-                    (self.tag_element, self.tag_matcher),
-                )
-                for m in i.finditer(line)
-            )
-
-            # Create spans for unmatched chunks of text
-            chunks = list(
-                itertools.pairwise(
-                    sorted({pos for span in subs for pos in span} | {0, len(line)})
-                )
-            )
-
-            # Add default processing for each unmatched span
-            for span in chunks:
-                if span not in subs:
-                    subs[span] = line[span[0] : span[1]].translate(self.escape_table)
+                yield END_PARAGRAPH
+                yield PARAGRAPH
 
-            line = "".join("" if cue and cue.span() == span else subs[span] for span in chunks)
-            yield line
+            yield Token(Kind.LINE, self.spans(line, cue))
 
         if terminate:
             if list_type:
-                yield "</p></li>"
-                yield f"</{list_type}>"
+                yield END_ITEM
+                yield Token(Kind.END_LIST, list_type)
             elif paragraph:
+                yield END_PARAGRAPH
+            yield END_BLOCK
+
+    def render(self, tokens: Iterable[Token]) -> Generator[str]:
+        "The HTML5 backend. Generates one line of output for each token."
+        for kind, value in tokens:
+            if kind is Kind.LINE:
+                if len(value) == 1 and type(value[0]) is Span and not value[0].tag:
+                    yield value[0].text.translate(self.escape_table)
+                else:
+                    yield "".join(map(self.span_element, value))
+            elif kind is Kind.PARAGRAPH:
+                yield "<p>"
+            elif kind is Kind.END_PARAGRAPH:
                 yield "</p>"
-                paragraph = False
-            yield "</blockquote>"
+            elif kind is Kind.ITEM:
+                yield "<li><p>" if value is None else f'<li id="{value}"><p>'
+            elif kind is Kind.END_ITEM:
+                yield "</p></li>"
+            elif kind is Kind.LIST:
+                yield f"<{value}>"
+            elif kind is Kind.END_LIST:
+                yield f"</{value}>"
+            elif kind is Kind.BLOCK:
+                yield f'<blockquote cite="{html.escape(value.text, quote=True)}">' if value else "<blockquote>"
+            elif kind is Kind.END_BLOCK:
+                yield "</blockquote>"
+            elif kind is Kind.CUE:
+                yield self.cue_element(value)
+            elif kind is Kind.COMMENT:
+                yield f"<!-- {value.translate(self.escape_table)} -->"
+
+    def parse_block(self, cue, lines, terminate=False) -> Generator[str]:
+        yield from self.render(self.tokenize_block(cue, lines, terminate))
+
+    def html(self, block: tuple[Token]) -> str:
+        return "\n".join(self.render(block))
 
     def loads(self, text: str, marker: str = "\n", **kwargs) -> str:
         self.reset()
         result = marker.join(i.strip() for i in self.feed(text, terminate=True))
         return f"{result}{marker}"
 
-    def feed(self, text: str, terminate=False, **kwargs):
-        self.source.extend(text.splitlines(keepends=False))
-        yield from self.parse_lines(terminate)
+    def tokenize(self, text: str) -> list[tuple[Token]]:
+        "Parse a whole text into blocks of tokens, which any backend may then render."
+        self.reset()
+        return list(self.feed_tokens(text, terminate=True))
+
+    def stream(self, lines: Iterable[str], output: TextIO, marker: str = "\n", flush: bool = False) -> int:
+        "Write each block to the output as soon as it is complete. Returns the number of blocks written."
+        rv = 0
+        for block in itertools.chain.from_iterable(itertools.chain(
+            (self.feed(line) for line in lines), [self.feed("", terminate=True)]
+        )):
+            output.write(f"{block.strip()}{marker}")
+            if flush:
+                output.flush()
+            rv += 1
+        return rv
+
+    def feed_tokens(self, text: str, terminate=False) -> Generator[tuple[Token]]:
+        "Generate the tokens of each block as soon as it is complete."
+        lines = self.record(text.splitlines(keepends=False))
+        while self.ready:
+            yield self.ready.popleft()
+        yield from self.parse_lines(lines, terminate)
+
+    def feed(self, text: str, terminate=False, **kwargs) -> Generator[str]:
+        for block in self.feed_tokens(text, terminate):
+            yield self.html(block)
 
     def reset(self):
         self.source.clear()
-        self._index = 0
+        self.pending.clear()
+        self.ready.clear()
+        self.cue = None
+
+
+def convert(path: Path) -> Path:
+    "Convert a SpeechMark file to HTML5, which is saved beside it."
+    rv = path.with_suffix(".html")
+    if rv == path:
+        raise ValueError("Input would be overwritten by its output")
+    temp = rv.with_name(f".{rv.name}.{os.getpid()}.tmp")
+    try:
+        with open(path, "r", encoding="utf8") as source, open(temp, "w", encoding="utf8") as output:
+            SpeechMark().stream(source, output)
+        os.replace(temp, rv)
+    finally:
+        temp.unlink(missing_ok=True)
+    return rv
+
+
+def attempt(path: Path) -> Path | Exception:
+    "Convert a file, returning any error rather than raising it, so that one bad file does not stop a batch."
+    try:
+        return convert(path)
+    except (OSError, ValueError) as error:
+        return error
+
+
+def batch(paths: list[Path], jobs: int = 1) -> Iterable[tuple[Path, Path | Exception]]:
+    "Convert files over a pool of processes, generating each path with its output or the error raised."
+    if jobs < 2 or len(paths) < 2:
+        yield from zip(paths, map(attempt, paths))
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from zip(paths, executor.map(attempt, paths, chunksize=max(1, len(paths) // (4 * jobs))))
 
 
 def parser():
@@ -279,6 +500,14 @@ def parser():
         usage="\n".join((__doc__, textwrap.dedent(SpeechMark.__doc__)))
     )
 
+    rv.add_argument(
+        "paths", nargs="*", default=[],
+        help="Convert these files, or those matching these glob patterns, to HTML5 saved beside them"
+    )
+    rv.add_argument(
+        "-j", "--jobs", type=int, default=(jobs := os.cpu_count() or 1),
+        help=f"Convert files over this number of processes [{jobs}]"
+    )
     rv.add_argument(
         "--version", action="store_true", default=False,
         help="display the package version"
@@ -292,11 +521,29 @@ def main(args):
         print(__version__)
         return 0
 
-    sm = SpeechMark()
-    text = sys.stdin.read()
-    html5 = sm.loads(text)
-    print(html5)
-    return 0
+    if not args.paths:
+        # Stream standard input to standard output, block by block
+        SpeechMark().stream(sys.stdin, sys.stdout, flush=True)
+        return 0
+
+    rv = 0
+    paths = []
+    for arg in args.paths:
+        if not any(c in arg for c in "*?["):
+            paths.append(Path(arg))
+            continue
+
+        matches = [Path(i) for i in sorted(glob.glob(arg, recursive=True))]
+        if not matches:
+            print(f"{arg}: No files match", file=sys.stderr)
+            rv = 1
+        paths.extend(i for i in matches if i.suffix != ".html")
+
+    for path, result in batch(paths, jobs=args.jobs):
+        if isinstance(result, Exception):
+            print(f"{path}: {result}", file=sys.stderr)
+            rv = 1
+    return rv
 
 
 def run():
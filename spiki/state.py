@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from collections.abc import Iterator
+from collections.abc import MutableMapping
+from pathlib import Path
+
+from spiki.plugin import Change
+from spiki.plugin import Phase
+
+
+class Record:
+    """
+    A view onto the state of one path in a State store.
+
+    Records hold no data of their own. They are cheap to create, and any update made
+    through them is stored directly in the columns of the State.
+
+    """
+
+    __slots__ = ("store", "id")
+
+    def __init__(self, store: "State", id: int):
+        self.store = store
+        self.id = id
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(id={self.id}, path={self.path!r}, phase={self.phase})"
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self.store is other.store and self.id == other.id
+        return NotImplemented
+
+    @property
+    def path(self) -> Path:
+        return self.store.paths[self.id]
+
+    @property
+    def type(self) -> str:
+        return self.store.types[self.id]
+
+    @type.setter
+    def type(self, value: str):
+        self.store.types[self.id] = value
+
+    @property
+    def phase(self) -> Phase:
+        return self.store.phases[self.id]
+
+    @phase.setter
+    def phase(self, value: Phase):
+        self.store.phases[self.id] = value
+
+    @property
+    def text(self) -> str:
+        return self.store.texts[self.id]
+
+    @text.setter
+    def text(self, value: str):
+        self.store.texts[self.id] = value
+
+    @property
+    def node(self) -> dict:
+        "The node of the path, or None once it has been freed."
+        return self.store.nodes[self.id]
+
+    @node.setter
+    def node(self, value: dict):
+        self.store.nodes[self.id] = value
+
+    @property
+    def doc(self) -> str:
+        return self.store.docs[self.id]
+
+    @doc.setter
+    def doc(self, value: str):
+        self.store.docs[self.id] = value
+
+    @property
+    def result(self) -> Path:
+        return self.store.results[self.id]
+
+    @result.setter
+    def result(self, value: Path):
+        self.store.results[self.id] = value
+
+
+class State(MutableMapping):
+    """
+    The state of every path in a build, stored by column.
+
+    Each path is given an integer id on first sight. Its fields are kept in separate lists
+    indexed by that id, so that any one field may be freed for all paths once no later
+    phase has need of it.
+
+    """
+
+    fields = ("type", "phase", "text", "node", "doc", "result")
+
+    def __init__(self):
+        self.ids = dict()
+        self.paths = []
+        self.types = []
+        self.phases = []
+        self.texts = []
+        self.nodes = []
+        self.docs = []
+        self.results = []
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self)} paths)"
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Path]:
+        return iter(self.ids)
+
+    def __contains__(self, path: Path) -> bool:
+        return path in self.ids
+
+    def __getitem__(self, path: Path) -> Record:
+        return Record(self, self.ids[path])
+
+    def __setitem__(self, path: Path, change: Change | Record):
+        try:
+            n = self.ids[path]
+        except KeyError:
+            n = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+            for column in (self.types, self.phases, self.texts, self.nodes, self.docs, self.results):
+                column.append(None)
+
+        self.types[n] = change.type
+        self.phases[n] = change.phase
+        self.texts[n] = change.text
+        self.nodes[n] = change.node
+        self.docs[n] = change.doc
+        self.results[n] = change.result
+
+    def __delitem__(self, path: Path):
+        n = self.ids.pop(path)
+        self.paths[n] = None
+        self.free(n, *self.fields)
+
+    def setdefault(self, path: Path, change: Change = None) -> Record:
+        if path not in self.ids:
+            self[path] = change or Change(path=path)
+        return self[path]
+
+    def id(self, path: Path) -> int:
+        return self.ids[path]
+
+    def free(self, id: int, *fields: tuple[str]) -> int:
+        "Release the data held in the given fields for the path with this id."
+        for field in fields or ("text", "node", "doc"):
+            getattr(self, f"{field}s")[id] = None
+        return id
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from collections.abc import Mapping
+import functools
+import string
+
+
+class Substitution:
+    """
+    A format string, parsed once and then filled many times.
+
+    It accepts the syntax of `str.format` with keyword fields only, eg: '{metadata[title]}'.
+    Each field name is replaced by a position, so that values are looked up once from a sequence
+    of mappings, rather than from a merged dictionary built for each use.
+
+    """
+
+    __slots__ = ("text", "template", "fields")
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1 << 14)
+    def compile(text: str) -> "Substitution":
+        return Substitution(text)
+
+    @staticmethod
+    def translate(text: str, index: dict[str, int]) -> str:
+        "Rewrite a format string so that it takes positional arguments, recording the position of each name."
+        rv = []
+        for prefix, name, spec, conversion in string.Formatter().parse(text):
+            rv.append(prefix.replace("{", "{{").replace("}", "}}"))
+            if name is None:
+                continue
+
+            # The name of the argument ends at the first attribute or index, eg: '{page.title}', '{items[0]}'
+            first = name.split(".", 1)[0].split("[", 1)[0]
+            if not first or first.isdecimal():
+                raise IndexError(f"Positional field in '{text}'")
+
+            rv.append(f"{{{index.setdefault(first, len(index))}{name[len(first):]}")
+            if conversion:
+                rv.append(f"!{conversion}")
+            if spec:
+                # The specification may itself hold fields, eg: '{total:{width}d}'
+                rv.append(f":{Substitution.translate(spec, index)}")
+            rv.append("}")
+        return "".join(rv)
+
+    def __init__(self, text: str):
+        self.text = text
+        index = dict()
+        self.template = self.translate(text, index)
+        self.fields = tuple(index)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.text!r})"
+
+    @property
+    def static(self) -> bool:
+        "True when the text has no fields, and so formats to the same string in every context."
+        return not self.fields
+
+    def format(self, *layers: tuple[Mapping], reserved: frozenset = frozenset()) -> str:
+        """
+        Fill the fields from the layers of a read-only context, the first layer taking precedence.
+        Names in `reserved` are settings rather than values in the first layer, and so are sought only below it.
+
+        """
+        values = []
+        for name in self.fields:
+            for n, layer in enumerate(layers):
+                if n == 0 and name in reserved:
+                    continue
+                try:
+                    values.append(layer[name])
+                    break
+                except KeyError:
+                    continue
+            else:
+                raise KeyError(name)
+        return self.template.format(*values)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Benchmarks for the parser and renderer. Run them from the command line::
+
+    python -m spiki.test.benchmark
+
+"""
+
+import argparse
+import sys
+import timeit
+
+from spiki.renderer import Programs
+from spiki.renderer import Renderer
+from spiki.speechmark import SpeechMark
+
+
+def measure(stmt, number: int, repeat: int = 5) -> float:
+    "The best time of several runs, in seconds per call."
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def construction(number: int = 10000) -> dict[str, float]:
+    "The cost of the objects built for every page."
+    parser = SpeechMark()
+    programs = Programs()
+    return {
+        "SpeechMark()": measure(SpeechMark, number),
+        "Escape table (uncached)": measure(
+            lambda: SpeechMark.build_escape_table.__wrapped__(parser.noescape), max(1, number // 100)
+        ),
+        "Renderer(parser=shared)": measure(lambda: Renderer({}, cache=programs, parser=parser), number),
+    }
+
+
+def inline(lines: list[str], reference=None, number: int = 10) -> dict[str, float]:
+    "The throughput of inline rendering in lines per second, and that of a reference implementation if given."
+    sm = SpeechMark()
+    cues = [sm.cue_matcher.match(line) for line in lines]
+    rv = {"parse_inline": len(lines) / measure(lambda: list(map(sm.parse_inline, lines, cues)), number)}
+    if reference:
+        rv["reference"] = len(lines) / measure(
+            lambda: [reference(sm, line, cue) for line, cue in zip(lines, cues)], number
+        )
+    return rv
+
+
+def parser():
+    rv = argparse.ArgumentParser(usage=__doc__)
+    rv.add_argument(
+        "-n", "--number", type=int, default=(number := 10000),
+        help=f"Set the number of calls in each timing run [{number}]."
+    )
+    return rv
+
+
+def main(args):
+    # The corpus is that of the tests, which check parse_inline against the same reference
+    from spiki.test.test_speechmark import inline_corpus
+    from spiki.test.test_speechmark import reference_inline
+
+    for label, seconds in construction(args.number).items():
+        print(f"{label:<32}{seconds * 1e6:>12.2f} us", file=sys.stdout)
+
+    lines = inline_corpus()
+    for label, rate in inline(lines, reference=reference_inline, number=max(1, args.number // 1000)).items():
+        print(f"{label:<32}{rate:>12.0f} lines/s", file=sys.stdout)
+    return 0
+
+
+def run():
+    p = parser()
+    args = p.parse_args()
+    rv = main(args)
+    sys.exit(rv)
+
+
+if __name__ == "__main__":
+    run()
@@ -21,6 +21,7 @@ import tempfile
 import textwrap
 import tomllib
 import unittest
+import zipfile
 
 import spiki
 from spiki.plugin import Phase
@@ -73,3 +74,30 @@ class VisitorTests(unittest.TestCase):
         self.assertEqual(len([i for i in witness if i.phase == Phase.EXTEND]), 1)
         self.assertEqual(files[0].name, "__main__.py")
         self.assertEqual(text, check)
+
+    def test_archive_rebuild(self):
+        plugin_types = [
+            "spiki.plugins.finder:Finder",
+            "spiki.plugins.loader:Loader",
+            "spiki.plugins.writer:Writer",
+            "spiki.plugins.bootstrapper:Bootstrapper",
+        ]
+        examples = importlib.resources.files("spiki.examples")
+        with tempfile.TemporaryDirectory() as parent_name:
+            output_path = pathlib.Path(parent_name).joinpath("output")
+            output_path.mkdir()
+            output_path.joinpath(".stray.tmp").write_text("")
+            names = []
+            for n in range(2):
+                output_path.with_suffix(".pyz").unlink(missing_ok=True)
+                with Visitor(*plugin_types, output=output_path, paths=[examples.joinpath("basic")]) as visitor:
+                    list(visitor.walk(*visitor.options["paths"]))
+
+                with zipfile.ZipFile(output_path.with_suffix(".pyz")) as archive:
+                    names.append(sorted(archive.namelist()))
+
+        # Pages unchanged by the second build are archived too
+        self.assertIn("__main__.py", names[0])
+        self.assertTrue(any(i.endswith(".html") for i in names[0]))
+        self.assertEqual(names[0], names[1])
+        self.assertNotIn(".stray.tmp", names[1])
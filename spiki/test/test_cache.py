@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import pathlib
+import tempfile
+import unittest
+
+from spiki.cache import Cache
+from spiki.visitor import Visitor
+
+
+class CacheTests(unittest.TestCase):
+
+    def test_get_put(self):
+        with tempfile.TemporaryDirectory() as temp_name:
+            cache = Cache(pathlib.Path(temp_name), namespace="test")
+            key = cache.key(b"[metadata]")
+            self.assertNotEqual(key, cache.key(b"[metadata] "))
+            self.assertIsNone(cache.get(key))
+
+            obj = dict(metadata=dict(time=datetime.datetime(2026, 1, 1)), blocks=["a", "b"])
+            self.assertIs(cache.put(key, obj), obj)
+            rv = cache.get(key)
+            self.assertEqual(rv, obj)
+            self.assertIsNot(rv, obj)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            cache.path.joinpath(f"{key}.pickle").write_bytes(b"corrupt")
+            self.assertIsNone(cache.get(key))
+            self.assertFalse(cache.path.joinpath(f"{key}.pickle").exists())
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as temp_name:
+            cache = Cache(pathlib.Path(temp_name), max_size=2048)
+            keys = [cache.key(bytes([n])) for n in range(8)]
+            for n, key in enumerate(keys):
+                cache.put(key, "x" * 500)
+                os.utime(cache.path.joinpath(f"{key}.pickle"), ns=(n * 10 ** 9, n * 10 ** 9))
+
+            # Reading an entry makes it the most recently used
+            self.assertTrue(cache.get(keys[0]))
+            self.assertEqual(cache.evict(), 5)
+            self.assertEqual(sorted(i.stem for i in cache.path.iterdir()), sorted([keys[0], keys[6], keys[7]]))
+
+    def test_loader(self):
+        plugin_types = ["spiki.plugins.finder:Finder", "spiki.plugins.loader:Loader"]
+        with tempfile.TemporaryDirectory() as temp_name:
+            root = pathlib.Path(temp_name).resolve()
+            source = root.joinpath("source")
+            source.mkdir()
+            source.joinpath("a.toml").write_text("[metadata]\ntitle = 'A'\n")
+            source.joinpath("b.toml").write_text("# Nothing but a comment\n")
+            entries = []
+            for n in range(2):
+                with Visitor(*plugin_types, paths=[source], output=root, cache=root.joinpath("cache")) as visitor:
+                    witness = list(visitor.walk(source))
+                    loader = visitor.running[1]
+                    self.assertEqual((loader.cache.hits, loader.cache.misses), (2 * n, 2 - 2 * n))
+                    self.assertEqual(visitor.state[source.joinpath("a.toml")].node["metadata"]["title"], "A")
+                    entries.append({i.name: i.stat().st_ino for i in loader.cache.path.iterdir()})
+
+            # An empty table is a hit like any other, and so is not written again
+            self.assertEqual(entries[0], entries[1])
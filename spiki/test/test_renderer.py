@@ -15,11 +15,19 @@
 # You should have received a copy of the GNU General Public License along with spiki.
 # If not, see <https://www.gnu.org/licenses/>.
 
+import copy
+import io
+import pathlib
+import tempfile
 import textwrap
 import tomllib
 import unittest
 
+from spiki.cache import Cache
+from spiki.renderer import Blocks
+from spiki.renderer import Programs
 from spiki.renderer import Renderer
+from spiki.speechmark import SpeechMark
 
 
 class RendererTests(unittest.TestCase):
@@ -272,3 +280,151 @@ class RendererTests(unittest.TestCase):
         template = tomllib.loads(toml)
         rv = Renderer().serialize(template)
         self.assertIn("Happy Monday!", rv)
+
+    def test_compiled_programs(self):
+        base = tomllib.loads(textwrap.dedent("""
+        [html]
+        config = {tag_mode = "pair"}
+        attrib = {lang = "en"}
+
+        [html.head]
+        title = "{metadata[title]}"
+
+        [html.head.meta]
+        config = {tag_mode = "void"}
+        attrib = {charset = "UTF-8"}
+
+        [html.body.header]
+        blocks = '''<> Welcome to the site.'''
+
+        [html.body.footer]
+        blocks = '''<> Page {metadata[title]}'''
+        """))
+        programs = Programs()
+        for n in range(4):
+            # Pages share the same base subtrees, as they do when merged by Loader
+            page = dict(metadata=dict(title=f"Page {n}"), doc=dict(html=dict(base["html"])))
+            page["doc"]["html"]["body"] = dict(base["html"]["body"], main=dict(p=f"Text {n}"))
+            plain = Renderer(copy.deepcopy(page)).serialize()
+            compiled = Renderer(page, cache=programs).serialize()
+            self.assertEqual(compiled, plain)
+            self.assertIn(f"<title>Page {n}</title>", compiled)
+            self.assertIn(f"<p>Text {n}</p>", compiled)
+
+        head = base["html"]["head"]
+        self.assertIn(head, [tree for tree, program in programs.values()])
+        self.assertEqual(base["html"]["head"]["meta"]["attrib"], {"charset": "UTF-8"})
+        self.assertEqual(base["html"]["config"], {"tag_mode": "pair"})
+
+    def test_fragments(self):
+        base = tomllib.loads(textwrap.dedent("""
+        [html]
+        config = {tag_mode = "pair"}
+
+        [html.body.header]
+        blocks = ["<> Welcome to {site[name]}."]
+
+        [html.body.footer]
+        blocks = ["<> Page {metadata[title]}"]
+        """))
+        for limit in [1 << 16, 64]:
+            programs = Programs(limit=limit)
+            for n in range(4):
+                page = dict(site=dict(name="Spiki"), metadata=dict(title=f"{n}"), doc=dict(html=dict(base["html"])))
+                page["doc"]["html"]["body"] = dict(base["html"]["body"], main=dict(p=f"Text {n}"))
+                plain = Renderer(copy.deepcopy(page)).serialize()
+                compiled = Renderer(page, cache=programs).serialize()
+                with self.subTest(limit=limit, n=n):
+                    self.assertEqual(compiled, plain)
+                    self.assertIn(f"Page {n}", compiled)
+                    self.assertLessEqual(programs.length, limit)
+
+            with self.subTest(limit=limit):
+                # The header is filled the same way for every page, but the footer is not
+                texts = [text for key, text in programs.fragments.items()]
+                self.assertEqual(sum(i.startswith("<header>") for i in texts), int(limit > 64))
+                self.assertEqual(programs.length, sum(len(i) for i in texts))
+
+    def test_block_cache(self):
+        template = tomllib.loads(textwrap.dedent("""
+        [metadata]
+        title = "Blocks"
+
+        [doc.html.body.main]
+        blocks = [
+            "<> Choose one:\\n1. Tea\\n2. Coffee",
+            "<> Choose one:\\n1. Tea\\n2. Coffee",
+            "<> About {metadata[title]}!",
+        ]
+        """))
+        expected = Renderer(template).serialize()
+        self.assertIn('<li id="01-1">', expected)
+        with tempfile.TemporaryDirectory() as temp_name:
+            store = Cache(pathlib.Path(temp_name))
+            blocks = Blocks(store=store)
+            self.assertEqual(Renderer(template, blocks=blocks).serialize(), expected)
+            self.assertEqual((blocks.misses, blocks.hits), (2, 1))
+
+            # A new process finds the blocks on disk
+            blocks = Blocks(store=store)
+            self.assertEqual(Renderer(template, blocks=blocks).serialize(), expected)
+            self.assertEqual((blocks.misses, blocks.hits), (0, 3))
+
+            # Blocks parsed with other options are kept apart
+            parser = SpeechMark(noescape="")
+            rv = Renderer(template, parser=parser, blocks=blocks).serialize()
+            self.assertEqual(rv, Renderer(template, parser=SpeechMark(noescape="")).serialize())
+            self.assertIn("&excl;", rv)
+            self.assertEqual((blocks.misses, blocks.hits), (2, 4))
+
+    def test_template_unchanged(self):
+        toml = textwrap.dedent("""
+        [metadata]
+        title = "Unchanged"
+
+        [doc.html]
+        config = {tag_mode = "pair"}
+        attrib = {lang = "en"}
+
+        [doc.html.head]
+        title = "{metadata[title]}"
+
+        [doc.html.body.main]
+        blocks = ["<> One", "<> Two {metadata[title]}"]
+        """)
+        template = tomllib.loads(toml)
+        witness = copy.deepcopy(template)
+        rv = [Renderer(template).serialize() for n in range(2)]
+        self.assertEqual(template, witness)
+        self.assertEqual(rv[0], rv[1])
+        self.assertIn('<html lang="en">', rv[0])
+        self.assertIn("<title>Unchanged</title>", rv[0])
+        self.assertIn("Two Unchanged", rv[0])
+
+    def test_stream(self):
+        toml = textwrap.dedent("""
+        [metadata]
+        title = "Café"
+
+        [doc.html]
+        config = {tag_mode = "pair"}
+
+        [doc.html.head]
+        title = "{metadata[title]}"
+
+        [doc.html.body.main]
+        blocks = ["<> One", "<> Two {metadata[title]}"]
+        """)
+        template = tomllib.loads(toml)
+        expected = Renderer(template).serialize()
+        for size in [1, 16, 1 << 16]:
+            with self.subTest(size=size):
+                text = io.StringIO()
+                rv = Renderer(template).stream(text, size=size)
+                self.assertEqual(text.getvalue(), expected)
+                self.assertEqual(rv, len(expected))
+
+                data = io.BytesIO()
+                rv = Renderer(template).stream(data, size=size)
+                self.assertEqual(data.getvalue(), expected.encode("utf8"))
+                self.assertEqual(rv, len(expected.encode("utf8")))
@@ -16,13 +16,25 @@
 # If not, see <https://www.gnu.org/licenses/>.
 
 import html
+import io
+import itertools
+import pathlib
+import random
 import re
+import tempfile
 import textwrap
 import tomllib
 import unittest
+from unittest import mock
 
 import spiki
+import spiki.speechmark
+from spiki.speechmark import Cue
+from spiki.speechmark import Kind
+from spiki.speechmark import Span
 from spiki.speechmark import SpeechMark
+from spiki.speechmark import Token
+from spiki.test import benchmark
 
 __doc__ = f"""
 :Version: {spiki.__version__}
@@ -52,6 +64,44 @@ Head = ("propose", "confirm", "counter", "abandon", "condemn", "declare")
 Hand = ("decline", "suggest", "promise", "disavow", "deliver")
 
 
+def reference_inline(sm: SpeechMark, line: str, cue=None) -> str:
+    "The original rendering of a line, which searched separately for each kind of markup."
+    subs = dict(
+        (m.span(), fn(m))
+        for fn, i in (
+            (lambda m: sm.cue_element(Cue.of(m)), sm.cue_matcher),
+            (lambda m: sm.span_element(Span("a", m["label"], m["link"])), sm.link_matcher),
+            (lambda m: sm.span_element(Span(sm.tagging[m["tag"]], m["text"])), sm.tag_matcher),
+        )
+        for m in i.finditer(line)
+    )
+    chunks = list(itertools.pairwise(sorted({pos for span in subs for pos in span} | {0, len(line)})))
+    for span in chunks:
+        if span not in subs:
+            subs[span] = line[span[0] : span[1]].translate(sm.escape_table)
+    return "".join("" if cue and cue.span() == span else subs[span] for span in chunks)
+
+
+def inline_corpus(size: int = 2000) -> list[str]:
+    "The lines of the Syntax examples, some hard cases, and a reproducible sample of random markup."
+    lines = [
+        line
+        for label, text, data, fn in Syntax.examples
+        for markup in data.get("markup", {}).values()
+        for line in textwrap.dedent(markup).splitlines()
+    ]
+    lines.extend([
+        "*a [b* c](d)",
+        "[a_b](c_d)",
+        "<A> *b* [c](d) `e` _f_",
+        "*a*b*c* [x](y)[z](w)",
+        "_[a](b)_ `c]` [d](`e`)",
+    ])
+    rng = random.Random(0)
+    lines.extend("".join(rng.choices("ab <>[]()*_`&.", k=rng.randint(0, 24))) for n in range(size))
+    return lines
+
+
 class SupportTests(unittest.TestCase):
 
     def test_elaboration_directive(self):
@@ -65,6 +115,181 @@ class SupportTests(unittest.TestCase):
         rv = sm.loads(text)
         self.assertIn("Ask about football", rv)
 
+    def test_shared_tables(self):
+        a = SpeechMark()
+        b = SpeechMark()
+        c = SpeechMark(noescape="")
+        self.assertIs(a.cue_matcher, b.cue_matcher)
+        self.assertIs(a.escape_table, b.escape_table)
+        self.assertIsNot(a.escape_table, c.escape_table)
+        self.assertEqual(a.loads("Tea & cake!"), "<blockquote>\n<p>\nTea &amp; cake!\n</p>\n</blockquote>\n")
+        self.assertEqual(c.loads("Tea & cake!"), "<blockquote>\n<p>\nTea &amp; cake&excl;\n</p>\n</blockquote>\n")
+
+    def test_benchmark_construction(self):
+        rv = benchmark.construction(number=10)
+        self.assertLess(rv["SpeechMark()"], rv["Escape table (uncached)"])
+
+    def test_benchmark_inline(self):
+        rv = benchmark.inline(inline_corpus(size=20), reference=reference_inline, number=1)
+        self.assertEqual(set(rv), {"parse_inline", "reference"})
+        self.assertTrue(all(i > 0 for i in rv.values()))
+
+    def test_inline_reference(self):
+        sm = SpeechMark()
+        for line in inline_corpus():
+            cue = sm.cue_matcher.match(line)
+            with self.subTest(line=line):
+                self.assertEqual(sm.parse_inline(line), reference_inline(sm, line))
+                self.assertEqual(sm.parse_inline(line, cue), reference_inline(sm, line, cue))
+
+    def test_streaming(self):
+        text = textwrap.dedent("""
+        <PHONE.announcing@GUEST,STAFF> Ring riiing!
+        <GUEST:thinks> I wonder if anyone is going to answer that phone.
+            + Wait
+            + Answer it
+
+        <STAFF> *Hello?*
+        """).strip()
+        expected = SpeechMark().loads(text)
+
+        sm = SpeechMark(maxlen=2)
+        rv = []
+        for n, line in enumerate(text.splitlines()):
+            blocks = list(sm.feed(line))
+            # Each block is emitted once, as soon as the next cue arrives
+            self.assertEqual(len(blocks), int(n in (1, 5)), line)
+            rv.extend(blocks)
+            self.assertLessEqual(len(sm.source), 2)
+        rv.extend(sm.feed("", terminate=True))
+
+        self.assertEqual(len(rv), 3)
+        self.assertEqual("\n".join(i.strip() for i in rv) + "\n", expected)
+        self.assertFalse(list(sm.feed("", terminate=True)))
+
+    def test_history(self):
+        text = "<A> Hello\n<B> Goodbye"
+        sm = SpeechMark(text.splitlines())
+        self.assertFalse(sm.source)
+        self.assertEqual(sm.text, "")
+        self.assertEqual("".join(sm.feed("", terminate=True)), "".join(SpeechMark().feed(text, terminate=True)))
+
+        sm = SpeechMark(maxlen=None)
+        list(sm.feed(text, terminate=True))
+        self.assertEqual(sm.text, text)
+
+    def test_tokens(self):
+        text = textwrap.dedent("""
+        <GUEST:thinks> I wonder if *anyone* will [answer](tel:123).
+            1. Wait
+            2. Answer it
+        <STAFF> `Hello?`
+        """).strip()
+        sm = SpeechMark()
+        blocks = sm.tokenize(text)
+        self.assertEqual(len(blocks), 2)
+        self.assertEqual(
+            [i.kind for i in blocks[0]],
+            [
+                Kind.BLOCK, Kind.CUE, Kind.PARAGRAPH, Kind.LINE,
+                Kind.END_PARAGRAPH, Kind.LIST, Kind.ITEM, Kind.LINE, Kind.END_ITEM, Kind.ITEM, Kind.LINE,
+                Kind.END_ITEM, Kind.END_LIST, Kind.END_BLOCK,
+            ]
+        )
+        cue = blocks[0][1].value
+        self.assertEqual((cue.role, cue.mode, cue.text), ("GUEST", ":thinks", "<GUEST:thinks>"))
+        self.assertEqual(
+            blocks[0][3].value,
+            (
+                Span("", " I wonder if ", None), Span("em", "anyone", None), Span("", " will ", None),
+                Span("a", "answer", "tel:123"), Span("", ".", None),
+            )
+        )
+        self.assertEqual([i.value for i in blocks[0] if i.kind == Kind.ITEM], ["1", "2"])
+        self.assertEqual(blocks[1][3], Token(Kind.LINE, (Span("", " ", None), Span("code", "Hello?", None))))
+
+        # A plain text backend
+        words = " ".join(
+            span.text for block in blocks for token in block if token.kind == Kind.LINE for span in token.value
+        )
+        self.assertEqual(words.split(), "I wonder if anyone will answer . Wait Answer it Hello?".split())
+
+        self.assertEqual("\n".join(sm.html(i) for i in blocks) + "\n", SpeechMark().loads(text))
+
+    def test_initial_lines(self):
+        lines = ["<A> One", "<B> Two"]
+        sm = SpeechMark(lines)
+        rv = list(sm.feed("<C> Three", terminate=True))
+        self.assertEqual(len(rv), 3)
+        self.assertEqual("\n".join(rv) + "\n", SpeechMark().loads("\n".join(lines + ["<C> Three"])))
+
+    def test_element_api(self):
+        sm = SpeechMark()
+        cue = sm.cue_matcher.match("<GUEST:thinks> Hmm")
+        self.assertEqual(sm.cue_element(cue), sm.cue_element(Cue.of(cue)))
+        self.assertEqual(sm.cue_element(cue), '<cite data-role="GUEST" data-mode=":thinks">GUEST</cite>')
+
+        with self.assertWarns(DeprecationWarning):
+            rv = sm.tag_element(sm.tag_matcher.search("a *b & c* d"))
+        self.assertEqual(rv, "<em>b &amp; c</em>")
+
+        with self.assertWarns(DeprecationWarning):
+            rv = sm.link_element(sm.link_matcher.search("a [b](c?d=1&e=2) f"))
+        self.assertEqual(rv, '<a href="c?d=1&amp;e=2">b</a>')
+
+
+class CommandLineTests(unittest.TestCase):
+
+    text = "<A> Hello, *World*!\n<B> Hi!\n"
+
+    def test_stream(self):
+        args = spiki.speechmark.parser().parse_args([])
+        with mock.patch("sys.stdin", io.StringIO(self.text)), mock.patch("sys.stdout", io.StringIO()) as output:
+            rv = spiki.speechmark.main(args)
+        self.assertEqual(rv, 0)
+        self.assertEqual(output.getvalue(), SpeechMark().loads(self.text))
+
+    def test_batch(self):
+        with tempfile.TemporaryDirectory() as temp_name:
+            temp_path = pathlib.Path(temp_name)
+            paths = [temp_path.joinpath(f"{n:02d}.txt") for n in range(6)]
+            for n, path in enumerate(paths):
+                path.write_text(self.text.replace("Hi", f"Hi {n}"))
+            temp_path.joinpath("bad.txt").write_bytes(b"\xff\xfe")
+
+            for jobs in [1, 2]:
+                with self.subTest(jobs=jobs):
+                    args = spiki.speechmark.parser().parse_args(["-j", f"{jobs}", f"{temp_path}/*.txt"])
+                    with mock.patch("sys.stderr", io.StringIO()) as errors:
+                        rv = spiki.speechmark.main(args)
+                    self.assertEqual(rv, 1)
+                    self.assertIn("bad.txt", errors.getvalue())
+                    for n, path in enumerate(paths):
+                        self.assertEqual(
+                            path.with_suffix(".html").read_text(),
+                            SpeechMark().loads(path.read_text())
+                        )
+                    self.assertEqual(len(list(temp_path.glob("*.html"))), 6)
+                    self.assertFalse(list(temp_path.glob(".*")))
+
+            # Outputs matched by a pattern are not converted in their turn
+            outputs = {i: i.read_bytes() for i in temp_path.glob("*.html")}
+            args = spiki.speechmark.parser().parse_args([f"{temp_path}/*"])
+            with mock.patch("sys.stderr", io.StringIO()) as errors:
+                rv = spiki.speechmark.main(args)
+            self.assertEqual(rv, 1)
+            self.assertEqual(errors.getvalue().count("\n"), 1, errors.getvalue())
+            self.assertEqual(outputs, {i: i.read_bytes() for i in temp_path.glob("*.html")})
+
+            for arg in [f"{paths[0].with_suffix('.html')}", f"{temp_path}/*.md"]:
+                with self.subTest(arg=arg):
+                    args = spiki.speechmark.parser().parse_args([arg])
+                    with mock.patch("sys.stderr", io.StringIO()) as errors:
+                        rv = spiki.speechmark.main(args)
+                    self.assertEqual(rv, 1)
+                    self.assertIn(arg, errors.getvalue())
+                    self.assertEqual(outputs, {i: i.read_bytes() for i in temp_path.glob("*.html")})
+
 
 class Syntax(unittest.TestCase):
     """
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import pathlib
+import unittest
+
+from spiki.plugin import Change
+from spiki.plugin import Phase
+from spiki.state import Record
+from spiki.state import State
+
+
+class StateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.state = State()
+        self.paths = [pathlib.Path(f"/site/{i}.toml") for i in "abc"]
+        for path in self.paths:
+            self.state[path] = Change(path=path, type="application/toml", text=f"# {path.name}")
+
+    def test_mapping(self):
+        self.assertEqual(len(self.state), 3)
+        self.assertEqual(list(self.state), self.paths)
+        self.assertIn(self.paths[1], self.state)
+        self.assertNotIn(pathlib.Path("/site/d.toml"), self.state)
+        self.assertTrue(all(isinstance(i, Record) for i in self.state.values()))
+        self.assertEqual([k for k, v in self.state.items() if v.path == k], self.paths)
+        self.assertRaises(KeyError, self.state.__getitem__, pathlib.Path("/site/d.toml"))
+
+    def test_record(self):
+        record = self.state[self.paths[0]]
+        self.assertEqual(record.text, "# a.toml")
+        self.assertEqual(record.type, "application/toml")
+        self.assertEqual(record.node, {})
+        self.assertIsNone(record.doc)
+
+        record.node["metadata"] = {"title": "A"}
+        record.doc = "<p>A</p>"
+        record.phase = Phase.RENDER
+        self.assertEqual(self.state[self.paths[0]], record)
+        self.assertEqual(self.state[self.paths[0]].node["metadata"]["title"], "A")
+        self.assertEqual(self.state[self.paths[0]].doc, "<p>A</p>")
+        self.assertEqual(self.state[self.paths[0]].phase, Phase.RENDER)
+        self.assertRaises(AttributeError, setattr, record, "extra", None)
+
+    def test_setdefault(self):
+        record = self.state.setdefault(self.paths[0], Change(path=self.paths[0], text="ignored"))
+        self.assertEqual(record.text, "# a.toml")
+
+        path = pathlib.Path("/site/d.toml")
+        record = self.state.setdefault(path, Change(path=path, text="new"))
+        record.phase = Phase.SURVEY
+        self.assertEqual(self.state[path].text, "new")
+        self.assertEqual(self.state[path].phase, Phase.SURVEY)
+        self.assertEqual(self.state.id(path), 3)
+
+    def test_delete(self):
+        record = self.state[self.paths[1]]
+        del self.state[self.paths[1]]
+        self.assertEqual(list(self.state), [self.paths[0], self.paths[2]])
+        self.assertIsNone(record.path)
+        self.assertIsNone(record.text)
+        self.assertEqual(self.state[self.paths[2]].text, "# c.toml")
+
+    def test_free(self):
+        record = self.state[self.paths[2]]
+        record.doc = "<p>C</p>"
+        self.state.free(self.state.id(self.paths[2]), "text")
+        self.assertIsNone(record.text)
+        self.assertEqual(record.doc, "<p>C</p>")
+
+        self.state.free(record.id)
+        self.assertIsNone(record.doc)
+        self.assertIsNone(record.node)
+        self.assertEqual(record.type, "application/toml")
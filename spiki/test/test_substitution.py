@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from types import SimpleNamespace
+import unittest
+
+from spiki.substitution import Substitution
+
+
+class SubstitutionTests(unittest.TestCase):
+
+    def test_compatible(self):
+        context = dict(metadata=dict(title="Title"), item=SimpleNamespace(size=3), width=6)
+        for text in [
+            "",
+            "No fields",
+            "{{Escaped}} braces",
+            "{metadata[title]}",
+            "{metadata[title]!r} and {metadata[title]:>8}",
+            "{item.size:{width}d} of {item.size:03d}",
+        ]:
+            with self.subTest(text=text):
+                self.assertEqual(Substitution(text).format(context), text.format(**context))
+
+    def test_static(self):
+        self.assertTrue(Substitution("{{Escaped}}").static)
+        self.assertEqual(Substitution("{{Escaped}}").format(), "{Escaped}")
+        self.assertFalse(Substitution("{metadata[title]}").static)
+        self.assertEqual(Substitution("{a}{b:{a}}{a}").fields, ("a", "b"))
+
+    def test_cached(self):
+        text = "{metadata[title]}"
+        self.assertIs(Substitution.compile(text), Substitution.compile(text))
+
+    def test_layers(self):
+        tree = dict(title="Local", config=dict(tag_mode="pair"))
+        context = dict(title="Global", config="Site", page=1)
+        rv = Substitution("{title} {config} {page}").format(tree, context, reserved=frozenset(["config"]))
+        self.assertEqual(rv, "Local Site 1")
+        self.assertEqual(tree, dict(title="Local", config=dict(tag_mode="pair")))
+
+    def test_field_names(self):
+        rv = Substitution("{page[title]} {items[0]} {x1.real}")
+        self.assertEqual(rv.fields, ("page", "items", "x1"))
+        self.assertEqual(rv.format(dict(page=dict(title="T"), items="ab", x1=1)), "T a 1")
+
+    def test_errors(self):
+        self.assertRaises(KeyError, Substitution("{missing}").format, dict(present=1))
+        self.assertRaises(IndexError, Substitution, "{}")
+        self.assertRaises(IndexError, Substitution, "{0}")
+        self.assertRaises(IndexError, Substitution, "{0.title}")
+        self.assertRaises(IndexError, Substitution, "{[0]}")
+        self.assertRaises(ValueError, Substitution, "{unclosed")
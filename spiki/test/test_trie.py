@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import pathlib
+import unittest
+
+from spiki.trie import Trie
+
+
+class TrieTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = pathlib.Path("/site")
+        self.trie = Trie()
+        for path in ["index.toml", "a/index.toml", "a/b/c/index.toml", "a/b/page.toml", "d/index.toml"]:
+            self.trie.add(self.root.joinpath(path))
+
+    def test_add(self):
+        self.assertIn(self.root.joinpath("a", "index.toml"), self.trie)
+        self.assertNotIn(self.root.joinpath("a", "b", "page.toml"), self.trie)
+        self.assertNotIn(self.root.joinpath("a", "b", "index.toml"), self.trie)
+
+    def test_get(self):
+        self.assertEqual(self.trie.get(self.root.joinpath("a", "page.toml")), self.root.joinpath("a", "index.toml"))
+        self.assertIsNone(self.trie.get(self.root.joinpath("a", "b", "page.toml")))
+        self.assertIsNone(self.trie.get(pathlib.Path("/other/page.toml")))
+
+    def test_ancestors(self):
+        self.assertEqual(
+            self.trie.ancestors(self.root.joinpath("a", "b", "c", "d", "page.toml")),
+            [self.root.joinpath("index.toml"), self.root.joinpath("a", "index.toml"), self.root.joinpath("a", "b", "c", "index.toml")]
+        )
+        self.assertEqual(
+            self.trie.ancestors(self.root.joinpath("a", "index.toml")),
+            [self.root.joinpath("index.toml"), self.root.joinpath("a", "index.toml")]
+        )
+        self.assertEqual(self.trie.ancestors(pathlib.Path("/other/page.toml")), [])
+
+    def test_discard(self):
+        self.trie.discard(self.root.joinpath("a", "index.toml"))
+        self.trie.discard(self.root.joinpath("x", "index.toml"))
+        self.assertEqual(
+            self.trie.ancestors(self.root.joinpath("a", "b", "c", "page.toml")),
+            [self.root.joinpath("index.toml"), self.root.joinpath("a", "b", "c", "index.toml")]
+        )
@@ -15,21 +15,72 @@
 # You should have received a copy of the GNU General Public License along with spiki.
 # If not, see <https://www.gnu.org/licenses/>.
 
+import contextlib
 import importlib.resources
+import json
 import pathlib
+import shutil
 import tempfile
 import textwrap
+import time
 import tomllib
 import unittest
+from unittest import mock
 
 import spiki
+from spiki.metrics import Metrics
+from spiki.plugin import Change
 from spiki.plugin import Phase
+from spiki.plugin import Plugin
 from spiki.renderer import Renderer
 from spiki.visitor import Visitor
+from spiki.watcher import Watcher
+
+
+class Counter(Plugin):
+
+    def __init__(self, visitor):
+        super().__init__(visitor)
+        self.produced = 0
+
+    def gen_survey(self, path: pathlib.Path = None, **kwargs):
+        for n in range(100):
+            self.produced += 1
+            yield Change(self, path=path.joinpath(f"{n:03d}.toml"))
 
 
 class VisitorTests(unittest.TestCase):
 
+    plugin_types = [
+        "spiki.plugins.finder:Finder",
+        "spiki.plugins.loader:Loader",
+        "spiki.plugins.writer:Writer",
+    ]
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_path = pathlib.Path(temp_dir.name).resolve()
+
+    def copy_example(self, name: str, dest: pathlib.Path = None) -> pathlib.Path:
+        "Copy an example to a directory of its own, where a test may change it."
+        dest = dest or self.temp_path.joinpath(name)
+        shutil.copytree(importlib.resources.files("spiki.examples").joinpath(name), dest)
+        return dest
+
+    def test_streaming_dispatch(self):
+        with Visitor("spiki.test.test_visitor:Counter") as visitor:
+            plugin = visitor.running[0]
+            changes = visitor.walk(pathlib.Path("."))
+            change = next(changes)
+            self.assertEqual(change.phase, Phase.SURVEY)
+            self.assertEqual(plugin.produced, 1)
+            self.assertEqual(len(visitor.state), 1)
+
+            witness = list(changes)
+            self.assertEqual(plugin.produced, 100)
+            self.assertEqual(len(visitor.state), 100)
+
     def test_example_atomic(self):
         plugin_types = [
             "spiki.plugins.finder:Finder",
@@ -99,6 +150,7 @@ class VisitorTests(unittest.TestCase):
 
             output_path = pathlib.Path(output_name)
             files = list(output_path.glob("*.css")) + list(output_path.glob("*.html"))
+            images = list(output_path.glob("*.jpg"))
 
         self.assertEqual(len(visitor.state), 10, visitor.state)
         path = list(visitor.state)[0]
@@ -121,3 +173,472 @@ class VisitorTests(unittest.TestCase):
         self.assertEqual(len(files), 7, files)
         self.assertEqual(file_names[0], "a.html")
         self.assertEqual(file_names[2], "basics.css")
+        self.assertEqual(len(images), 3, images)
+
+    def test_incremental_build(self):
+        def build(source, output):
+            with Visitor(*self.plugin_types, paths=[source], output=output, incremental=True) as visitor:
+                return visitor, list(visitor.walk(source))
+
+        source = self.copy_example("basic")
+        output = self.temp_path.joinpath("output")
+        output.mkdir()
+
+        visitor, witness = build(source, output)
+        self.assertFalse(visitor.skip)
+        self.assertTrue(output.with_suffix(".manifest.json").exists())
+        self.assertEqual(len([i for i in witness if i.phase == Phase.RENDER]), 10)
+
+        visitor, witness = build(source, output)
+        self.assertEqual({i.name for i in visitor.skip}, {"a.toml", "b.toml", "c.toml", "index.toml"})
+        self.assertEqual(len([i for i in witness if i.phase == Phase.RENDER]), 6)
+        self.assertEqual(len(list(output.glob("*.html"))), 4)
+
+        source.joinpath("b.toml").write_text(source.joinpath("b.toml").read_text() + "\n")
+        visitor, witness = build(source, output)
+        self.assertEqual({i.name for i in visitor.skip}, {"a.toml", "c.toml", "index.toml"})
+        self.assertNotIn(Phase.INGEST, visitor.skip[source.joinpath("index.toml")])
+        self.assertIn(Phase.RENDER, visitor.skip[source.joinpath("index.toml")])
+        self.assertEqual(
+            {i.path.name for i in witness if i.phase == Phase.RENDER and i.path.suffix == ".toml"},
+            {"b.toml"}
+        )
+
+        source.joinpath("index.toml").write_text(source.joinpath("index.toml").read_text() + "\n")
+        visitor, witness = build(source, output)
+        self.assertFalse(visitor.skip)
+
+        output.joinpath("c.html").unlink()
+        visitor, witness = build(source, output)
+        self.assertEqual({i.name for i in visitor.skip}, {"a.toml", "b.toml", "index.toml"})
+        self.assertTrue(output.joinpath("c.html").exists())
+
+    def test_parallel_build(self):
+        plugin_types = [
+            "spiki.plugins.finder:Finder",
+            "spiki.plugins.loader:Loader",
+            "spiki.plugins.highlighter:Highlighter",
+            "spiki.plugins.writer:Writer",
+        ]
+        outputs = {}
+        source = self.copy_example("basic")
+        source.joinpath("code.toml").write_text(textwrap.dedent("""
+        [doc.html.body.main.pre]
+        config = {tag_mode = "pair", text_escape = "none", style = "emacs"}
+        code = "[metadata]\\ntitle = 'Code'"
+        """))
+
+        for jobs in (1, 2):
+            output = self.temp_path.joinpath(f"output_{jobs}")
+            output.mkdir()
+            with Visitor(*plugin_types, paths=[source], output=output, jobs=jobs) as visitor:
+                witness = list(visitor.walk(source))
+
+            self.assertEqual(visitor.concurrent(Phase.RENDER), jobs > 1)
+            # Pages are merged with their index, which is the state of another path
+            self.assertFalse(visitor.concurrent(Phase.EXTEND))
+            self.assertFalse(visitor.concurrent(Phase.INGEST))
+            self.assertTrue(all(i.object in visitor.running for i in witness if i.object))
+            outputs[jobs] = {i.name: i.read_bytes() for i in output.iterdir()}
+
+        self.assertIn("pygments_emacs.css", outputs[1])
+        self.assertIn(b'class="highlight"', outputs[1]["code.html"])
+        self.assertEqual(outputs[1], outputs[2])
+
+    def test_parallel_sharing(self):
+        source = self.copy_example("cyclic")
+        heads = {}
+        for jobs in (1, 2):
+            output = self.temp_path.joinpath(f"output_{jobs}")
+            output.mkdir()
+            with Visitor(*self.plugin_types, paths=[source], output=output, jobs=jobs) as visitor:
+                list(visitor.walk(source))
+
+            self.assertEqual(visitor.concurrent(Phase.RENDER), jobs > 1)
+            pages = [i for i in visitor.state.values() if i.path.name != "index.toml" and i.path.suffix == ".toml"]
+            heads[jobs] = {id(i.node["doc"]["html"]["head"]) for i in pages}
+
+        # Pages keep the subtrees they share with their index when rendered in parallel
+        self.assertEqual(len(heads[1]), 1, heads)
+        self.assertEqual(len(heads[2]), 1, heads)
+
+    def test_metrics_report(self):
+        source = self.copy_example("basic")
+
+        for jobs in (1, 2):
+            output = self.temp_path.joinpath(f"output_{jobs}")
+            output.mkdir()
+            report = self.temp_path.joinpath(f"build_{jobs}.json")
+            with Visitor(*self.plugin_types, paths=[source], output=output, jobs=jobs, report=report) as visitor:
+                with self.assertLogs("visitor", level="INFO") as logs:
+                    witness = list(visitor.walk(source))
+
+            data = json.loads(report.read_text())
+            rows = {(i["phase"], i["plugin"]): i for i in data["plugins"]}
+            with self.subTest(jobs=jobs):
+                self.assertIn("Total", "\n".join(logs.output))
+                self.assertEqual(rows["RENDER", "Writer"]["calls"], len(visitor.state))
+                self.assertEqual(rows["SURVEY", "Finder"]["changes"], len(visitor.state))
+                self.assertGreater(rows["RENDER", "Writer"]["bytes_out"], 0)
+                self.assertGreater(rows["EXPORT", "Writer"]["wall"], 0)
+                self.assertNotIn(("RENDER", "Finder"), rows)
+                self.assertEqual(list(data["phases"]), [i.name for i in Phase])
+                self.assertEqual(len(data["slowest"]), 10)
+                self.assertIn("a.toml", {i["path"] for i in data["slowest"]})
+
+    def test_metrics_clock(self):
+        metrics = Metrics()
+        for change in metrics.clock(Phase.RENDER, [Change(), Change()]):
+            # Time spent by the consumer is not counted against the phase
+            time.sleep(0.05)
+        self.assertLess(metrics.phases[Phase.RENDER], 0.05)
+
+    def test_low_memory(self):
+        outputs = {}
+        source = self.copy_example("basic")
+
+        for low_memory, jobs in [(False, 1), (True, 1), (True, 2)]:
+            output = self.temp_path.joinpath(f"output_{low_memory}_{jobs}")
+            output.mkdir()
+            with Visitor(*self.plugin_types, paths=[source], output=output, jobs=jobs, low_memory=low_memory) as visitor:
+                with self.assertLogs(level="INFO") as logs:
+                    witness = list(visitor.walk(source))
+                outputs[low_memory, jobs] = {i.name: i.read_bytes() for i in output.iterdir()}
+
+                pages = [i for i in visitor.state.values() if i.path.suffix == ".toml"]
+                phases = [i.phase for i in witness if i.path == source.joinpath("a.toml")]
+                with self.subTest(low_memory=low_memory, jobs=jobs):
+                    self.assertTrue(all(i.result for i in pages))
+                    self.assertEqual(low_memory, all(i.doc is None and i.text is None for i in pages))
+                    self.assertEqual(low_memory, any("Peak memory" in i for i in logs.output))
+                    self.assertEqual(phases[-1], Phase.EXPORT)
+
+                    path = source.joinpath("b.toml")
+                    path.write_text(path.read_text().replace("Are you", "Are you now"))
+                    witness = list(visitor.refresh(path))
+                    self.assertIn("Are you now", output.joinpath("b.html").read_text())
+                    self.assertIn("<nav", output.joinpath("b.html").read_text())
+                    path.write_text(path.read_text().replace("Are you now", "Are you"))
+
+        self.assertEqual(outputs[False, 1], outputs[True, 1])
+        self.assertEqual(outputs[False, 1], outputs[True, 2])
+
+    def test_stream(self):
+        outputs = {}
+        source = self.copy_example("basic")
+
+        for stream, jobs in [(False, 1), (True, 1), (True, 2)]:
+            output = self.temp_path.joinpath(f"output_{stream}_{jobs}")
+            output.mkdir()
+            with Visitor(*self.plugin_types, paths=[source], output=output, jobs=jobs, stream=stream) as visitor:
+                witness = list(visitor.walk(source))
+                outputs[stream, jobs] = {i.name: i.read_bytes() for i in output.iterdir()}
+
+                pages = [i for i in visitor.state.values() if i.path.suffix == ".toml"]
+                with self.subTest(stream=stream, jobs=jobs):
+                    self.assertEqual(stream, visitor.running[-1].streamed)
+                    self.assertTrue(all(i.result for i in pages))
+                    self.assertEqual(stream, all(i.doc is None for i in pages))
+                    self.assertFalse(any(i.name.endswith(".tmp") for i in output.iterdir()))
+
+        # A plugin which reads the rendered pages needs them kept
+        reader = type("Reader", (Plugin,), dict(run_render=lambda self, **kwargs: None))
+        with Visitor(*self.plugin_types, paths=[source], output=output, stream=True) as visitor:
+            visitor.running.append(reader(visitor))
+            self.assertFalse(visitor.running[-2].streamed)
+
+        self.assertEqual(outputs[False, 1], outputs[True, 1])
+        self.assertEqual(outputs[False, 1], outputs[True, 2])
+
+    def test_stream_rebuild(self):
+        plugin_types = [
+            "spiki.plugins.finder:Finder",
+            "spiki.plugins.loader:Loader",
+            "spiki.plugins.highlighter:Highlighter",
+            "spiki.plugins.writer:Writer",
+            "spiki.plugins.bootstrapper:Bootstrapper",
+        ]
+        source = self.copy_example("cyclic")
+        for export in ("direct", "swap"):
+            output = self.temp_path.joinpath(export, "output")
+            output.mkdir(parents=True)
+            for n in range(3):
+                with Visitor(
+                    *plugin_types, paths=[source], output=output, export=export,
+                    jobs=2, low_memory=True, incremental=True
+                ) as visitor:
+                    witness = list(visitor.walk(source))
+
+                with self.subTest(export=export, n=n):
+                    self.assertTrue(visitor.running[3].streamed)
+                    self.assertFalse(list(output.rglob("*.tmp")))
+                    self.assertTrue(list(output.rglob("*.css")))
+
+    def test_export_modes(self):
+        outputs = {}
+        source = self.copy_example("basic")
+
+        for export in ("stage", "direct", "swap"):
+            parent = self.temp_path.joinpath(export)
+            output = parent.joinpath("output")
+            output.mkdir(parents=True)
+            output.joinpath("extra.txt").write_text("Kept")
+            with Visitor(*self.plugin_types, paths=[source], output=output, export=export) as visitor:
+                witness = list(visitor.walk(source))
+                self.assertEqual(visitor.space == output, export != "stage")
+
+            outputs[export] = {i.name: i.read_bytes() for i in output.iterdir()}
+            with self.subTest(export=export):
+                self.assertEqual(outputs[export]["extra.txt"], b"Kept")
+                self.assertEqual([i.name for i in parent.iterdir()], ["output"])
+                self.assertFalse([i for i in output.iterdir() if i.name.startswith(".")])
+
+        self.assertEqual(outputs["stage"], outputs["direct"])
+        self.assertEqual(outputs["stage"], outputs["swap"])
+
+    def test_exchange(self):
+        for name in ("lhs", "rhs"):
+            self.temp_path.joinpath(name).mkdir()
+            self.temp_path.joinpath(name, "name.txt").write_text(name)
+
+        if not Visitor.exchange(self.temp_path.joinpath("lhs"), self.temp_path.joinpath("rhs")):
+            self.skipTest("Atomic exchange not supported")
+
+        self.assertEqual(self.temp_path.joinpath("lhs", "name.txt").read_text(), "rhs")
+        self.assertEqual(self.temp_path.joinpath("rhs", "name.txt").read_text(), "lhs")
+        with self.assertRaises(FileNotFoundError):
+            Visitor.exchange(self.temp_path.joinpath("lhs"), self.temp_path.joinpath("missing"))
+
+    def test_swap_refresh(self):
+        for exchange in (True, False):
+            with self.subTest(exchange=exchange):
+                temp_path = self.temp_path.joinpath(f"exchange_{exchange}")
+                source = self.copy_example("basic", temp_path.joinpath("source"))
+                parent = temp_path.joinpath("parent")
+                output = parent.joinpath("output")
+                output.mkdir(parents=True)
+                output.joinpath("extra.txt").write_text("Kept")
+
+                with (
+                    contextlib.nullcontext() if exchange else mock.patch.object(Visitor, "exchange", return_value=False),
+                    Visitor(*self.plugin_types, paths=[source], output=output, export="swap") as visitor,
+                ):
+                    witness = list(visitor.walk(source))
+                    self.assertTrue(all(i.result.is_relative_to(output) for i in visitor.state.values()))
+
+                    path = source.joinpath("b.toml")
+                    path.write_text(path.read_text().replace("Are you well?", "Are you quite well?"))
+                    witness = list(visitor.refresh(path))
+                    self.assertIn("Are you quite well?", output.joinpath("b.html").read_text())
+                    self.assertTrue(output.joinpath("a.html").exists())
+                    self.assertEqual(output.joinpath("extra.txt").read_text(), "Kept")
+
+                    source.joinpath("c.toml").unlink()
+                    witness = list(visitor.refresh(source.joinpath("c.toml")))
+                    self.assertFalse(output.joinpath("c.html").exists())
+                    self.assertTrue(output.joinpath("b.html").exists())
+
+                    # The previous output is kept to stage the next build
+                    self.assertEqual(len(list(parent.iterdir())), 2)
+
+                self.assertEqual([i.name for i in parent.iterdir()], ["output"])
+
+    def test_swap_within_source(self):
+        source = self.copy_example("basic")
+        output = source.joinpath("output")
+        output.mkdir()
+        with Visitor(*self.plugin_types, paths=[source], output=output, export="swap") as visitor:
+            for n in range(2):
+                witness = list(visitor.walk(source))
+                staged = visitor.retired
+                ignore = Watcher(visitor).ignore
+                with self.subTest(n=n):
+                    self.assertTrue(staged.is_relative_to(source))
+                    self.assertIn(format(staged), ignore)
+                    self.assertIn(format(output), ignore)
+                    self.assertFalse([i for i in visitor.state if i.is_relative_to(output)])
+                    self.assertFalse([i for i in visitor.state if i.is_relative_to(staged)])
+                    self.assertFalse([i for i in Watcher.scan(source, ignore=ignore) if i.is_relative_to(staged)])
+
+    def test_write_if_changed(self):
+        for export in ("stage", "direct"):
+            with self.subTest(export=export):
+                temp_path = self.temp_path.joinpath(export)
+                source = self.copy_example("basic", temp_path.joinpath("source"))
+                output = temp_path.joinpath("output")
+                output.mkdir()
+
+                def build():
+                    report = temp_path.joinpath("build.json")
+                    with Visitor(
+                        *self.plugin_types, paths=[source], output=output, export=export, report=report, incremental=True
+                    ) as visitor:
+                        witness = list(visitor.walk(source))
+                    return json.loads(report.read_text())["counts"]
+
+                counts = build()
+                self.assertEqual(counts, dict(written=10, skipped=0, removed=0))
+                mtimes = {i.name: i.stat().st_mtime_ns for i in output.iterdir()}
+
+                source.joinpath("b.toml").write_text(source.joinpath("b.toml").read_text() + "\n")
+                source.joinpath("c.toml").write_text(
+                    source.joinpath("c.toml").read_text().replace("rain has stopped", "rain stopped")
+                )
+                counts = build()
+                self.assertEqual(counts["removed"], 0)
+                self.assertGreater(counts["skipped"], 0)
+                self.assertGreater(counts["written"], 0)
+                self.assertEqual(output.joinpath("b.html").stat().st_mtime_ns, mtimes["b.html"])
+                self.assertEqual(output.joinpath("basics.css").stat().st_mtime_ns, mtimes["basics.css"])
+
+                source.joinpath("c.toml").unlink()
+                counts = build()
+                self.assertEqual(counts["removed"], 1)
+                self.assertFalse(output.joinpath("c.html").exists())
+                self.assertEqual(output.joinpath("a.html").stat().st_mtime_ns, mtimes["a.html"])
+
+    def test_asset_passthrough(self):
+        source = self.copy_example("basic")
+        output = self.temp_path.joinpath("output")
+        output.mkdir()
+        originals = {i.name: i.read_bytes() for i in source.iterdir()}
+
+        for export in ("direct", "stage", "direct", "swap", "stage"):
+            with Visitor(*self.plugin_types, paths=[source], output=output, export=export) as visitor:
+                witness = list(visitor.walk(source))
+
+            with self.subTest(export=export):
+                css = visitor.state[source.joinpath("basics.css")]
+                self.assertIsNone(css.text)
+                self.assertEqual(css.result.name, "basics.css")
+                for name in ("basics.css", "lion-671193_640.jpg"):
+                    self.assertEqual(output.joinpath(name).read_bytes(), originals[name])
+                    self.assertEqual(
+                        output.joinpath(name).stat().st_mtime_ns, source.joinpath(name).stat().st_mtime_ns
+                    )
+                self.assertEqual({i.name: i.read_bytes() for i in source.iterdir()}, originals)
+                self.assertFalse(output.joinpath("basics.css").samefile(source.joinpath("basics.css")))
+
+        for export in ("direct", "stage"):
+            shutil.rmtree(output)
+            output.mkdir()
+            with Visitor(*self.plugin_types, paths=[source], output=output, export=export, link=True) as visitor:
+                witness = list(visitor.walk(source))
+
+            with self.subTest(export=export, link=True):
+                self.assertTrue(output.joinpath("basics.css").samefile(source.joinpath("basics.css")))
+
+    def test_survey_ignore(self):
+        plugin_types = ["spiki.plugins.finder:Finder"]
+        root = self.temp_path
+        for name in [
+            "index.toml", "style.css", "draft.toml", "build.py",
+            ".git/config.toml", "node_modules/pkg/index.toml", "env/lib/site.toml",
+            "sub/a.toml", "sub/notes/b.toml", "sub/notes/c.toml", "sub/tmp/d.toml", "tmp/e.toml",
+        ]:
+            root.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+            root.joinpath(name).write_text("")
+        root.joinpath("env", "pyvenv.cfg").write_text("")
+        root.joinpath(".spikiignore").write_text("# Comment\ndraft.*\ntmp/\n")
+        root.joinpath("sub", ".spikiignore").write_text("notes/c.toml\n")
+
+        with Visitor(*plugin_types, paths=[root], output=root) as visitor:
+            witness = list(visitor.survey(root))
+            self.assertEqual(
+                [i.relative_to(root).as_posix() for i in visitor.state],
+                ["index.toml", "style.css", "sub/a.toml", "sub/notes/b.toml"]
+            )
+            self.assertEqual(visitor.state[root.joinpath("style.css")].type, "text/css")
+            self.assertFalse(list(visitor.survey(root.joinpath("sub", "notes", "c.toml"))))
+            self.assertFalse(list(visitor.survey(root.joinpath("node_modules", "pkg", "index.toml"))))
+            self.assertTrue(list(visitor.survey(root.joinpath("sub", "notes", "b.toml"))))
+
+        with Visitor(*plugin_types, paths=[root], output=root, include=["*.toml"], exclude=["sub/"]) as visitor:
+            witness = list(visitor.survey(root))
+            self.assertEqual([i.relative_to(root).as_posix() for i in visitor.state], ["index.toml"])
+
+    def test_dependency_graph(self):
+        plugin_types = [
+            "spiki.plugins.finder:Finder",
+            "spiki.plugins.loader:Loader",
+            "spiki.examples.eclectic.templater:Templater",
+            "spiki.plugins.writer:Writer",
+        ]
+
+        def build(source, output):
+            with Visitor(*plugin_types, paths=[source], output=output, incremental=True) as visitor:
+                return visitor, list(visitor.walk(source))
+
+        source = self.copy_example("eclectic")
+        output = self.temp_path.joinpath("output")
+        source.joinpath("about.toml").write_text("[doc.html.body]\nconfig = {tag_mode = 'pair'}\np = 'About'")
+        output.mkdir()
+
+        visitor, witness = build(source, output)
+        index_path = source.joinpath("index.toml")
+        page_path = source.joinpath("about.toml")
+        data_path = source.joinpath("orders.csv")
+        self.assertEqual(visitor.graph[index_path], {data_path})
+        self.assertEqual(visitor.graph[page_path], {index_path})
+        self.assertEqual(visitor.dependents(data_path), {index_path})
+        self.assertEqual(visitor.dependents(index_path), {page_path})
+
+        visitor, witness = build(source, output)
+        self.assertEqual(set(visitor.skip), {index_path, page_path})
+        self.assertEqual(visitor.dependents(data_path), {index_path})
+
+        data_path.write_text(data_path.read_text() + "\n")
+        visitor, witness = build(source, output)
+        self.assertEqual(set(visitor.skip), {page_path})
+
+    def test_refresh_index(self):
+        source = self.copy_example("basic")
+        output = self.temp_path.joinpath("output")
+        output.mkdir()
+        with Visitor(
+            *self.plugin_types, "spiki.plugins.bootstrapper:Bootstrapper", paths=[source], output=output
+        ) as visitor:
+            witness = list(visitor.walk(source))
+            virtual = source.joinpath("__main__.py")
+            self.assertIn(virtual, visitor.state)
+
+            path = source.joinpath("index.toml")
+            path.write_text(path.read_text() + "\n")
+            with self.assertNoLogs("finder", level="WARNING"):
+                witness = list(visitor.refresh(path))
+            self.assertNotIn(virtual, {i.path for i in witness if i.phase == Phase.SURVEY})
+            self.assertIn(virtual, visitor.state)
+            self.assertTrue(output.joinpath("__main__.py").exists())
+
+    def test_refresh(self):
+        source = self.copy_example("basic")
+        output = self.temp_path.joinpath("output")
+        output.mkdir()
+
+        with Visitor(*self.plugin_types, paths=[source], output=output) as visitor:
+            witness = list(visitor.walk(source))
+
+            path = source.joinpath("b.toml")
+            path.write_text(path.read_text().replace("Are you well?", "Are you quite well?"))
+            witness = list(visitor.refresh(path))
+            rendered = {i.path.name for i in witness if i.phase == Phase.RENDER}
+            self.assertEqual(rendered, {"b.toml"})
+            self.assertIn("Are you quite well?", output.joinpath("b.html").read_text())
+
+            path = source.joinpath("index.toml")
+            path.write_text(path.read_text() + "\n")
+            witness = list(visitor.refresh(path))
+            rendered = {i.path.name for i in witness if i.phase == Phase.RENDER and i.path.suffix == ".toml"}
+            self.assertEqual(rendered, {"a.toml", "b.toml", "c.toml", "index.toml"})
+
+            path = source.joinpath("d.toml")
+            path.write_text(source.joinpath("a.toml").read_text())
+            witness = list(visitor.refresh(path))
+            self.assertIn(path, visitor.state)
+            self.assertTrue(output.joinpath("d.html").exists())
+            self.assertLess(visitor.state[path].doc.index("<head"), visitor.state[path].doc.index("<body"))
+
+            path.unlink()
+            witness = list(visitor.refresh(path))
+            self.assertNotIn(path, visitor.state)
+            self.assertFalse(output.joinpath("d.html").exists())
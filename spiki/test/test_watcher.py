@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+import pathlib
+import tempfile
+import unittest
+
+from spiki.visitor import Visitor
+from spiki.watcher import Watcher
+
+
+class WatcherTests(unittest.TestCase):
+
+    def test_scan(self):
+        with tempfile.TemporaryDirectory() as temp_name:
+            temp_path = pathlib.Path(temp_name).resolve()
+            temp_path.joinpath("index.toml").write_text("")
+            temp_path.joinpath("sub").mkdir()
+            temp_path.joinpath("sub", "a.toml").write_text("[metadata]")
+
+            before = Watcher.scan(temp_path)
+            self.assertEqual(
+                set(before),
+                {temp_path.joinpath("index.toml"), temp_path.joinpath("sub", "a.toml")}
+            )
+            self.assertEqual(before[temp_path.joinpath("sub", "a.toml")][1], 10)
+
+            temp_path.joinpath("sub", "a.toml").write_text("[metadata]\n")
+            temp_path.joinpath("index.toml").unlink()
+            temp_path.joinpath("b.toml").write_text("")
+            after = Watcher.scan(temp_path)
+
+        self.assertEqual(
+            Watcher.compare(before, after),
+            {temp_path.joinpath(i) for i in ("index.toml", "b.toml", "sub/a.toml")}
+        )
+        self.assertFalse(Watcher.compare(after, after))
+
+    def test_scan_ignore(self):
+        with tempfile.TemporaryDirectory() as temp_name:
+            temp_path = pathlib.Path(temp_name).resolve()
+            temp_path.joinpath("index.toml").write_text("")
+            temp_path.joinpath("output").mkdir()
+            temp_path.joinpath("output", "index.html").write_text("")
+            temp_path.joinpath("output.manifest.json").write_text("{}")
+
+            ignore = frozenset(format(temp_path.joinpath(i)) for i in ("output", "output.manifest.json"))
+            rv = Watcher.scan(temp_path, ignore=ignore)
+
+        self.assertEqual(set(rv), {temp_path.joinpath("index.toml")})
+
+    def test_survey(self):
+        with tempfile.TemporaryDirectory() as temp_name:
+            root = pathlib.Path(temp_name).resolve()
+            for name in [
+                "index.toml", "draft.toml", "sub/a.toml", "sub/b.toml", ".git/HEAD", "node_modules/pkg/index.toml",
+                "env/pyvenv.cfg", "env/lib/site.toml", "output/index.html", "output.manifest.json",
+            ]:
+                root.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+                root.joinpath(name).write_text("")
+            root.joinpath(".spikiignore").write_text("draft.*\n")
+            root.joinpath("sub", ".spikiignore").write_text("b.toml\n")
+
+            with Visitor("spiki.plugins.finder:Finder", paths=[root], output=root.joinpath("output")) as visitor:
+                watcher = Watcher(visitor)
+                rv = watcher.survey(root)
+                self.assertEqual(set(rv), {root.joinpath("index.toml"), root.joinpath("sub", "a.toml")})
+                self.assertEqual(set(watcher.survey(root.joinpath("draft.toml"), root.joinpath("index.toml"))), {
+                    root.joinpath("index.toml")
+                })
+                witness = list(visitor.survey(root))
+                self.assertEqual(set(visitor.state), set(rv))
+
+            # Without a Finder, only the files which a build writes are left out
+            with Visitor(paths=[root], output=root.joinpath("output")) as visitor:
+                rv = Watcher(visitor).survey(root)
+                self.assertIn(root.joinpath(".git", "HEAD"), rv)
+                self.assertNotIn(root.joinpath("output", "index.html"), rv)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from pathlib import Path
+
+
+class Trie:
+    """
+    A tree of directories, recording the index file found in each of them.
+
+    Each query walks the parts of a path once from the top, so the cost of finding
+    the ancestry of a page grows with the depth of the tree rather than its size.
+
+    """
+
+    def __init__(self, name: str = "index.toml"):
+        self.name = name
+        self.nodes = dict()
+
+    def __contains__(self, path: Path) -> bool:
+        return self.get(path) == path
+
+    def add(self, path: Path) -> bool:
+        if path.name != self.name:
+            return False
+
+        node = self.nodes
+        for part in path.parent.parts:
+            node = node.setdefault(part, {})
+        node[None] = path
+        return True
+
+    def discard(self, path: Path):
+        node = self.nodes
+        for part in path.parent.parts:
+            try:
+                node = node[part]
+            except KeyError:
+                return
+        if node.get(None) == path:
+            del node[None]
+
+    def get(self, path: Path) -> Path:
+        "Return the index file in the same directory as `path`."
+        node = self.nodes
+        for part in path.parent.parts:
+            try:
+                node = node[part]
+            except KeyError:
+                return None
+        return node.get(None)
+
+    def ancestors(self, path: Path) -> list[Path]:
+        "Return the index files of the directories containing `path`, outermost first."
+        rv = []
+        node = self.nodes
+        for part in path.parent.parts:
+            try:
+                node = node[part]
+            except KeyError:
+                break
+            if None in node:
+                rv.append(node[None])
+        return rv
@@ -17,12 +17,18 @@
 
 from collections.abc import Callable
 from collections.abc import Generator
+import concurrent.futures
 import contextlib
 import copy
+import ctypes
 import dataclasses
 import datetime
 import decimal
+import errno
+import functools
+import itertools
 import logging
+import multiprocessing
 from numbers import Number
 import os.path
 from pathlib import Path
@@ -33,18 +39,31 @@ import tempfile
 import tomllib
 import warnings
 
+from spiki.manifest import Manifest
+from spiki.metrics import Metrics
+from spiki.metrics import peak_memory
 from spiki.plugin import Change
 from spiki.plugin import Phase
+from spiki.state import Record
+from spiki.state import State
+from spiki.trie import Trie
 
 
 class Visitor(contextlib.ExitStack):
 
+    delegate = None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1 << 16)
+    def resolve(path: Path) -> Path:
+        return path.resolve()
+
     @staticmethod
     def location_of(node: dict) -> Path:
         try:
-            return node["registry"]["index"]["registry"]["path"].resolve()
+            return Visitor.resolve(node["registry"]["index"]["registry"]["path"])
         except (AttributeError, KeyError, TypeError):
-            return node["registry"]["path"].resolve()
+            return Visitor.resolve(node["registry"]["path"])
 
     @staticmethod
     def url_of(node: dict) -> str:
@@ -55,28 +74,140 @@ class Visitor(contextlib.ExitStack):
     def __init__(self, *plugin_types: tuple[Callable], **kwargs):
         super().__init__()
         self.index_name = "index.toml"
-        self.state = dict()
+        self.state = State()
+        self.indexes = Trie(self.index_name)
         self.running = None
         self.space = None
         self.logger = logging.getLogger("visitor")
+        self.plugin_types = list(plugin_types)
         self.plugins = list(filter(None, (self.init_plugin(i) for i in plugin_types)))
+        self.manifest = None
+        self.inputs = dict()
+        self.skip = dict()
+        self.removed = dict()
+        self.retired = None
+        self.written = set()
+        self.metrics = None
         self.options = kwargs
 
     def __enter__(self):
         self.space = Path(tempfile.mkdtemp()).resolve()
+        self.callback(shutil.rmtree, self.space, ignore_errors=True)
         self.running = [self.enter_context(p) for p in self.plugins]
         return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        rv = super().__exit__(exc_type, exc_val, exc_tb)
-        shutil.rmtree(self.space, ignore_errors=True)
-        return rv
-
     @property
     def root(self) -> Path:
         paths = [i.resolve() for i in self.options.get("paths", [])]
         return Path(os.path.commonprefix(paths))
 
+    @property
+    def products(self) -> frozenset[str]:
+        """
+        The files and directories which a build writes, including the directory in which a swap is staged.
+        None of them is a source, even should it lie within the source tree.
+
+        """
+        rv = [i for i in (self.space, self.retired) if i is not None]
+        if self.options.get("output"):
+            output = Path(self.options["output"]).resolve()
+            rv.extend([output, output.with_suffix(".manifest.json"), output.with_suffix(".pyz")])
+        rv.extend(Path(self.options[i]).resolve() for i in ("report", "cache") if self.options.get(i))
+        return frozenset(format(i) for i in rv)
+
+    @staticmethod
+    def link(source: str, target: str):
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+    @staticmethod
+    @functools.cache
+    def renameat2() -> Callable:
+        try:
+            rv = ctypes.CDLL(None, use_errno=True).renameat2
+        except (AttributeError, OSError):
+            # Not Linux, or a C library which predates the call
+            return None
+        rv.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+        return rv
+
+    @staticmethod
+    def exchange(lhs: Path, rhs: Path) -> bool:
+        "Swap two paths in one atomic step. Returns False where the platform or file system cannot."
+        renameat2 = Visitor.renameat2()
+        if renameat2 is None:
+            return False
+
+        at_fdcwd, rename_exchange = -100, 2
+        if renameat2(at_fdcwd, os.fsencode(lhs), at_fdcwd, os.fsencode(rhs), rename_exchange) == 0:
+            return True
+
+        code = ctypes.get_errno()
+        if code in (errno.ENOSYS, errno.EINVAL, errno.ENOTSUP):
+            return False
+        raise OSError(code, os.strerror(code), format(lhs), None, format(rhs))
+
+    def stage(self, output: Path) -> Path:
+        "Create a directory beside the output, seeded with links to the files already in it."
+        if self.retired is not None:
+            # The output swapped out last time differs from the current one only in the files then written
+            rv, self.retired = self.retired, None
+            for name in self.written:
+                source = output.joinpath(name)
+                target = rv.joinpath(name)
+                target.unlink(missing_ok=True)
+                if source.is_file():
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    self.link(source, target)
+            return rv
+
+        rv = Path(tempfile.mkdtemp(prefix=f".{output.name}.", dir=output.parent)).resolve()
+        self.callback(shutil.rmtree, rv, ignore_errors=True)
+        if output.is_dir():
+            shutil.copytree(output, rv, copy_function=self.link, dirs_exist_ok=True)
+        return rv
+
+    def swap(self, output: Path, paths: set[Path] = None) -> Path:
+        """
+        Replace the output directory with the one staged beside it. The previous output takes the place
+        of the staged directory, so that it may be brought up to date to stage the next build.
+
+        """
+        staged = self.space
+        results = [self.state[i].result for i in (self.state if paths is None else paths) if i in self.state]
+        self.written = {
+            i.relative_to(parent)
+            for i in filter(None, results + list(self.removed.values()))
+            for parent in (staged, output) if i.is_relative_to(parent)
+        }
+
+        if not output.exists():
+            staged.rename(output)
+            self.retired = None
+        elif self.exchange(staged, output):
+            self.retired = staged
+        else:
+            retired = staged.with_name(f"{staged.name}.old")
+            output.rename(retired)
+            try:
+                staged.rename(output)
+            except OSError:
+                # Restore the previous output rather than leave none at all
+                retired.rename(output)
+                raise
+            retired.rename(staged)
+            self.retired = staged
+
+        # Results now lie in the output
+        for record in self.state.values():
+            if record.result is not None and record.result.is_relative_to(staged):
+                record.result = output.joinpath(record.result.relative_to(staged))
+
+        self.space = output
+        return output
+
     def init_plugin(self, type_name: str):
         try:
             cls = pkgutil.resolve_name(type_name)
@@ -88,67 +219,362 @@ class Visitor(contextlib.ExitStack):
         return plugin
 
     def ancestors(self, path: Path) -> list[Path]:
-        return sorted(
-            (p for p in self.nodes
-             if path.is_relative_to(p.parent)
-             and p.name == self.index_name
-            ),
-            key=lambda x: len(format(x))
+        return [i for i in self.indexes.ancestors(path) if i in self.state]
+
+    def depend(self, path: Path, *sources: list[Path]):
+        "Record that the output of a page depends upon other files."
+        depends = self.state[path].node.setdefault("registry", {}).setdefault("depends", [])
+        depends.extend(i for i in sources if i not in depends)
+
+    @property
+    def graph(self) -> dict[Path, set[Path]]:
+        "Map each page to the files upon which its output depends."
+        rv = {}
+        if self.manifest:
+            rv = {self.root.joinpath(k): {self.root.joinpath(i) for i in v} for k, v in self.manifest.graph.items()}
+        for path, change in self.state.items():
+            # A node released in low memory mode keeps only its dependencies
+            depends = (change.node or {}).get("registry", {}).get("depends")
+            if depends is not None:
+                rv[path] = set(depends)
+        return rv
+
+    def dependents(self, *paths: list[Path]) -> set[Path]:
+        "Return those pages whose output depends upon any of the given files."
+        paths = set(paths)
+        return {k for k, v in self.graph.items() if not v.isdisjoint(paths)}
+
+    def unchanged(self) -> dict[Path, list[Phase]]:
+        "Return those pages whose sources and dependencies are unchanged, with the phases they may skip."
+        if not self.options.get("incremental"):
+            return {}
+
+        output = self.options["output"]
+        self.manifest = Manifest(output.with_suffix(".manifest.json"), plugins=self.plugin_types).load()
+
+        rv = {}
+        stale = set()
+        cached = list(Phase)[3:11]
+        for path in (i for i in self.state if i.suffix == ".toml"):
+            chain = [i for i in self.ancestors(path) if i != path]
+            try:
+                self.inputs[path] = self.manifest.inputs(path, self.root, chain)
+            except OSError:
+                continue
+
+            if self.manifest.unchanged(self.manifest.key(path, self.root), self.inputs[path], output):
+                rv[path] = cached
+            else:
+                stale.add(path)
+
+        # Index files are still loaded when any of their descendants are to be rebuilt
+        for path in {i for path in stale for i in self.ancestors(path)}.intersection(rv):
+            rv[path] = cached[cached.index(Phase.EXTEND) + 1:]
+
+        self.logger.info(
+            f"Rebuilding {len(stale)} pages of {len(self.inputs)}",
+            extra=dict(phase=Phase.INGEST)
         )
+        return rv
 
-    def walk(self, *paths: list[Path]) -> Generator[tuple[Path, dict, str]]:
-        paths = [i.resolve() for i in paths]
-        for phase in [Phase.CONFIG, Phase.SURVEY]:
-            for path in paths:
-                for plugin in self.running:
-                    try:
-                        changes = list(plugin(phase, path=path))
-                    except Exception as error:
-                        self.logger.warning(error, extra=dict(phase=phase), exc_info=True)
-                        continue
-
-                    for change in changes:
-                        assert isinstance(change, Change) , f"Plugin violation ({plugin})!"
-                        yield dataclasses.replace(change, phase=phase)
-                        self.state[change.path] = dataclasses.replace(
-                            self.state.setdefault(change.path, change),
-                            phase=phase,
-                        )
-            if False:
-                for change in (c for plugin in self.running for c in list(plugin(phase)) if c):
-                    yield dataclasses.replace(change, phase=phase)
+    def update_manifest(self):
+        keys = {self.manifest.key(path, self.root): path for path in self.state}
+        self.manifest.entries = {k: v for k, v in self.manifest.entries.items() if k in keys}
+        for key, path in keys.items():
+            change = self.state[path]
+            if path in self.skip or path not in self.inputs or not change.result:
+                continue
 
-        for phase in list(Phase)[2:]:
-            for path in list(self.state):
-                for plugin in self.running:
-                    try:
-                        state = self.state[path]
-                    except KeyError:
-                        # Assume filtered out
-                        continue
-                    try:
-                        changes = list(plugin(phase, path=path, text=state.text, node=state.node, doc=state.doc))
-                    except Exception as error:
-                        self.logger.warning(error, extra=dict(phase=phase), exc_info=True)
-                        continue
-
-                    for change in changes:
+            depends = (change.node or {}).get("registry", {}).get("depends", [])
+            try:
+                self.manifest.record(
+                    key, self.inputs[path],
+                    result=change.result.relative_to(self.space).as_posix(),
+                    depends=self.manifest.digest_all(depends, self.root),
+                )
+            except ValueError:
+                continue
+        self.manifest.save()
+
+    def apply(self, path: Path | Record, change: Change):
+        state = path if isinstance(path, Record) else self.state[path]
+        if change.text:
+            state.text = change.text
+        if change.node:
+            state.node.update(change.node)
+        if change.doc:
+            state.doc = change.doc
+        if change.result:
+            state.result = change.result
+
+    def call(self, plugin, phase: Phase, path: Path = None, **kwargs) -> Generator[Change]:
+        changes = plugin(phase, path=path, **kwargs)
+        prefix = "end" if path is None else "gen" if phase == Phase.SURVEY else "run"
+        if self.metrics is None or not hasattr(plugin, f"{prefix}_{phase.name.lower()}"):
+            return changes
+        return self.metrics.measure(phase, plugin, path, changes, kwargs.get("text"), kwargs.get("doc"))
+
+    def concurrent(self, phase: Phase) -> bool:
+        "Phases run in parallel only when every plugin active in them declares it safe."
+        if self.options.get("jobs", 1) < 2:
+            return False
+
+        method = f"run_{phase.name.lower()}"
+        plugins = [i for i in self.running if getattr(i, method, None)]
+        return bool(plugins) and all(phase in i.parallel for i in plugins)
+
+    def dispatch(self, phase: Phase, path: Path) -> list[tuple[int, Change]]:
+        """
+        Run all plugins on one path. The changes returned may be passed between processes.
+        Plugins in a parallel phase must return a new node to change it, not modify the one they were given.
+
+        """
+        rv = []
+        try:
+            state = self.state[path]
+        except KeyError:
+            # Assume filtered out
+            return rv
+
+        for n, plugin in enumerate(self.running):
+            if state.path is None:
+                break
+            try:
+                node = state.node
+                for change in self.call(plugin, phase, path=path, text=state.text, node=node, doc=state.doc):
+                    assert isinstance(change, Change) , f"Plugin violation ({plugin})!"
+                    # Send back only the keys of the node which the plugin replaced.
+                    # Those it left alone may share objects with other records in the parent.
+                    delta = {} if change.node is node else {
+                        k: v for k, v in change.node.items() if state.node.get(k) is not v
+                    }
+                    self.apply(state, change)
+                    change.object = None
+                    change.node = delta
+                    rv.append((n, change))
+            except Exception as error:
+                self.logger.warning(error, extra=dict(phase=phase), exc_info=True)
+                continue
+        return rv
+
+    @staticmethod
+    def adopt(visitor: "Visitor"):
+        # Worker processes are forked, and so inherit the state of the Visitor
+        Visitor.delegate = visitor
+
+    @staticmethod
+    def delegated(phase: Phase, path: Path) -> tuple[list[tuple[int, Change]], Metrics]:
+        visitor = Visitor.delegate
+        if visitor.metrics is not None:
+            # Each task reports only its own measurements back to the parent process
+            visitor.metrics = Metrics()
+        return visitor.dispatch(phase, path), visitor.metrics
+
+    def parallelize(
+        self, phase: Phase, paths: list[Path]
+    ) -> Generator[tuple[Path, tuple[list[tuple[int, Change]], Metrics]]]:
+        "Spread the work of a phase across a pool of processes. Results are returned in order of path."
+        jobs = self.options.get("jobs", 1)
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            self.logger.warning("Parallel execution is unsupported on this platform", extra=dict(phase=phase))
+            yield from ((path, (self.dispatch(phase, path), None)) for path in paths)
+            return
+
+        self.logger.debug(f"Running {len(paths)} paths over {jobs} processes", extra=dict(phase=phase))
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, mp_context=context, initializer=self.adopt, initargs=(self,)
+        ) as executor:
+            results = executor.map(
+                self.delegated, itertools.repeat(phase), paths,
+                chunksize=max(1, len(paths) // (4 * jobs))
+            )
+            yield from zip(paths, results)
+
+    def report(self) -> dict:
+        "Log a summary of the build metrics, and save them to a file if requested."
+        path = self.options.get("report")
+        rv = self.metrics.write(path, root=self.root) if path else self.metrics.report(root=self.root)
+        for line in self.metrics.table(rv):
+            self.logger.info(line, extra=dict(phase=Phase.REPORT))
+        return rv
+
+    def survey_phase(self, phase: Phase, *paths: list[Path]) -> Generator[Change]:
+        for path in paths:
+            for plugin in self.running:
+                try:
+                    for change in self.call(plugin, phase, path=path):
                         assert isinstance(change, Change) , f"Plugin violation ({plugin})!"
-                        try:
-                            yield dataclasses.replace(change, phase=phase)
-                        except TypeError:
-                            continue
+                        change.phase = phase
+                        self.state.setdefault(change.path, change).phase = phase
+                        self.indexes.add(change.path)
+                        yield change
+                except Exception as error:
+                    self.logger.warning(error, extra=dict(phase=phase), exc_info=True)
+                    continue
+        if False:
+            for change in (c for plugin in self.running for c in list(plugin(phase)) if c):
+                yield dataclasses.replace(change, phase=phase)
+
+    def survey(self, *paths: list[Path]) -> Generator[Change]:
+        for phase in [Phase.CONFIG, Phase.SURVEY]:
+            changes = self.survey_phase(phase, *paths)
+            yield from changes if self.metrics is None else self.metrics.clock(phase, changes)
 
+    def visit(self, phase: Phase, path: Path, state: Record) -> Generator[Change]:
+        "Run all plugins on one path in this process."
+        for plugin in self.running:
+            if state.path is None:
+                # Filtered out by a previous plugin
+                break
+            try:
+                for change in self.call(plugin, phase, path=path, text=state.text, node=state.node, doc=state.doc):
+                    assert isinstance(change, Change) , f"Plugin violation ({plugin})!"
+                    change.phase = phase
+                    yield change
+                    self.apply(state, change)
+            except Exception as error:
+                self.logger.warning(error, extra=dict(phase=phase), exc_info=True)
+                continue
+
+    def release(self, phase: Phase, state: Record):
+        "In low memory mode, free those fields of a path which no later phase will read."
+        if phase == Phase.INGEST and state.path.suffix == ".toml" and state.node:
+            self.state.free(state.id, "text")
+        elif phase == Phase.EXPORT:
+            # Keep only what is needed to update the manifest
+            depends = state.node.get("registry", {}).get("depends")
+            self.state.free(state.id, "text", "node", "doc")
+            if depends:
+                state.node = dict(registry=dict(depends=depends))
+
+    def pipelined(self, phase: Phase) -> bool:
+        "Export each page as soon as it is rendered, when no plugin needs to see every rendered page first."
+        return (
+            phase == Phase.RENDER and self.options.get("low_memory", False)
+            and not any(hasattr(i, "end_render") for i in self.running)
+        )
+
+    def process_phase(self, phase: Phase, targets: set[Path], exported: set[Path]) -> Generator[Change]:
+        low_memory = self.options.get("low_memory", False)
+        export = self.options.get("export", "stage")
+        if phase == Phase.INGEST and targets is None:
+            self.skip = self.unchanged()
+
+        paths = [
+            i for i in self.state
+            if (targets is None or i in targets) and phase not in self.skip.get(i, [])
+            and i not in exported
+        ]
+        pipelined = self.pipelined(phase)
+        if self.concurrent(phase):
+            for path, (changes, metrics) in self.parallelize(phase, paths):
+                if metrics is not None:
+                    self.metrics.merge(metrics)
+                state = self.state[path]
+                for n, change in changes:
+                    change.object = self.running[n]
+                    change.phase = phase
+                    yield change
+                    self.apply(state, change)
+
+                if pipelined and state.path is not None:
+                    yield from self.visit(Phase.EXPORT, path, state)
+                    exported.add(path)
+                if low_memory and state.path is not None:
+                    self.release(Phase.EXPORT if pipelined else phase, state)
+            paths = []
+
+        for path in paths:
+            try:
+                state = self.state[path]
+            except KeyError:
+                # Assume filtered out
+                continue
+
+            yield from self.visit(phase, path, state)
+            if pipelined and state.path is not None:
+                yield from self.visit(Phase.EXPORT, path, state)
+                exported.add(path)
+            if low_memory and state.path is not None:
+                self.release(Phase.EXPORT if pipelined else phase, state)
+        else:
+            for plugin in self.running:
+                try:
+                    for change in filter(None, self.call(plugin, phase)):
                         if change.text:
-                            self.state[path].text = change.text
-                        if change.node:
-                            self.state[path].node.update(change.node)
-                        if change.doc:
-                            self.state[path].doc = change.doc
-                        if change.result:
-                            self.state[path].result = change.result
-            else:
-                for change in (c for plugin in self.running for c in list(plugin(phase)) if c):
-                    if change.text:
-                        self.state.setdefault(change.path, change).text = change.text
-                    yield dataclasses.replace(change, phase=phase)
+                            self.state.setdefault(change.path, change).text = change.text
+                            if targets is not None:
+                                targets.add(change.path)
+                        change.phase = phase
+                        yield change
+                except Exception as error:
+                    self.logger.warning(error, extra=dict(phase=phase), exc_info=True)
+                    continue
+
+        if phase == Phase.EXPORT and self.manifest:
+            self.update_manifest()
+
+        if phase == Phase.EXPORT and export == "swap":
+            self.swap(self.options["output"].resolve(), targets)
+
+    def process(self, targets: set[Path] = None) -> Generator[Change]:
+        export = self.options.get("export", "stage")
+        if export == "direct":
+            self.space = self.options["output"].resolve()
+        elif export == "swap":
+            self.space = self.stage(self.options["output"].resolve())
+
+        exported = set()
+        for phase in list(Phase)[2:]:
+            changes = self.process_phase(phase, targets, exported)
+            # Time spent by the consumer of each change is not counted against the phase
+            yield from changes if self.metrics is None else self.metrics.clock(phase, changes)
+
+        if self.options.get("low_memory", False):
+            self.logger.info(f"Peak memory {peak_memory() / 2 ** 20:.1f} MiB", extra=dict(phase=Phase.REPORT))
+        if self.metrics is not None:
+            self.report()
+
+    def walk(self, *paths: list[Path]) -> Generator[tuple[Path, dict, str]]:
+        paths = [i.resolve() for i in paths]
+        self.metrics = Metrics() if self.options.get("report") else None
+        yield from self.survey(*paths)
+        yield from self.process()
+
+    def refresh(self, *paths: list[Path]) -> Generator[Change]:
+        "Process again those files which have changed since the last walk, and the pages which depend on them."
+        paths = {i.resolve() for i in paths}
+        self.metrics = Metrics() if self.options.get("report") else None
+        removed = {i for i in paths if not i.exists()}
+        targets = (paths - removed).union(self.dependents(*paths)) - removed
+        for path in (i for i in paths if i.name == self.index_name):
+            # Records which plugins made rather than found on disk are left to those plugins
+            targets.update(i for i in self.state if i.is_relative_to(path.parent) and i.is_file())
+
+        # The outputs of deleted sources are kept until export, when they too are deleted
+        self.removed = {path: self.state[path].result for path in removed if path in self.state}
+        for path in removed:
+            self.state.pop(path, None)
+            self.indexes.discard(path)
+
+        # Index files which were skipped by an incremental build, or released to save memory, must now be loaded
+        targets.update(
+            i for path in list(targets) for i in self.ancestors(path)
+            if Phase.INGEST in self.skip.get(i, []) or self.options.get("low_memory", False)
+        )
+        self.skip = {}
+
+        for path in targets.intersection(self.state):
+            self.state[path] = Change(path=path, type=self.state[path].type)
+
+        if self.manifest:
+            for path in paths:
+                self.manifest.digests.pop(path, None)
+            for path in (i for i in targets if i.suffix == ".toml"):
+                chain = [i for i in self.ancestors(path) if i != path]
+                self.inputs[path] = self.manifest.inputs(path, self.root, chain)
+
+        yield from self.survey(*sorted(targets))
+        yield from self.process(targets)
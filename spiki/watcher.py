@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#   encoding: utf-8
+
+# Copyright (C) 2026 D E Haynes
+# This file is part of spiki.
+
+# Spiki is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or (at your option) any later version.
+#
+# Spiki is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+# the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with spiki.
+# If not, see <https://www.gnu.org/licenses/>.
+
+from collections.abc import Generator
+import logging
+import os
+from pathlib import Path
+import time
+
+from spiki.plugin import Phase
+from spiki.plugins.finder import Finder
+from spiki.visitor import Visitor
+
+
+class Watcher:
+    """
+    Polls a source tree for changes, and passes them to a Visitor for rebuilding.
+
+    Only stat metadata and ignore files are read while polling. The files watched are those the Finder surveys. The Visitor and its plugins are kept alive
+    between rebuilds, so each change costs only the work of the pages it affects.
+
+    """
+
+    @staticmethod
+    def scan(*paths: list[Path], ignore: frozenset[str] = frozenset()) -> dict[Path, tuple[int, int]]:
+        rv = {}
+        stack = [format(i.resolve()) for i in paths]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+
+            with entries:
+                for entry in entries:
+                    if entry.path in ignore:
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            rv[Path(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue
+        return rv
+
+    @staticmethod
+    def compare(before: dict, after: dict) -> set[Path]:
+        return {k for k in before.keys() | after.keys() if before.get(k) != after.get(k)}
+
+    def __init__(self, visitor: Visitor, interval: float = 0.5):
+        self.visitor = visitor
+        self.interval = interval
+        self.logger = logging.getLogger("watcher")
+
+    @property
+    def ignore(self) -> frozenset[str]:
+        "The files which a build writes, and which must not trigger another should they lie in the source tree."
+        return self.visitor.products
+
+    @property
+    def finder(self) -> Finder:
+        return next((i for i in self.visitor.running or [] if isinstance(i, Finder)), None)
+
+    def survey(self, *paths: list[Path]) -> dict[Path, tuple[int, int]]:
+        "Stat the files which the Finder would survey, or without one, all those which the build does not write."
+        finder = self.finder
+        if finder is None:
+            return self.scan(*paths, ignore=self.ignore)
+
+        rv = {}
+        for path in (i.resolve() for i in paths):
+            if path.is_file():
+                entries = [] if finder.ignored(path) else [(path, None)]
+            else:
+                entries = ((Path(entry.path), entry) for entry, rel in finder.walk(path, quiet=True))
+
+            for path, entry in entries:
+                try:
+                    stat = entry.stat() if entry else path.stat()
+                    rv[path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    continue
+        return rv
+
+    def watch(self, *paths: list[Path]) -> Generator[tuple[set[Path], dict]]:
+        snapshot = self.survey(*paths)
+        while True:
+            time.sleep(self.interval)
+            # A swap may stage the next build in a new directory
+            latest = self.survey(*paths)
+            changed = self.compare(snapshot, latest)
+            snapshot = latest
+            if changed:
+                yield changed, latest
+
+    def run(self, *paths: list[Path]) -> int:
+        self.logger.info(f"Watching for changes every {self.interval} s", extra=dict(phase=Phase.REPORT))
+        n = 0
+        try:
+            for changed, snapshot in self.watch(*paths):
+                start = time.monotonic()
+                saved = max((snapshot[i][0] for i in changed if i in snapshot), default=time.time_ns())
+                delay = time.time() - saved / 1e9
+
+                written = start
+                for n, change in enumerate(self.visitor.refresh(*changed), start=n + 1):
+                    if change.phase in (Phase.RENDER, Phase.EXPORT):
+                        written = time.monotonic()
+
+                latency = written - start
+                self.logger.info(
+                    f"Rebuilt {len(changed)} changed file{'s' if len(changed) > 1 else ''} "
+                    f"in {1000 * latency:.0f} ms ({1000 * (delay + latency):.0f} ms since saved)",
+                    extra=dict(phase=Phase.REPORT)
+                )
+        except KeyboardInterrupt:
+            pass
+        return n